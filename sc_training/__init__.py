@@ -1,3 +1,17 @@
 __version__ = "0.0.1"
 
-from sc_training.profiler import *
\ No newline at end of file
+import importlib
+
+
+# The profiler, and with it the ingest modules and their dependencies, is
+# only imported the first time one of its names is used.
+def __getattr__(name):
+    if name.startswith('__') and name != '__all__':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    profiler = importlib.import_module(f'{__name__}.profiler')
+    if name == '__all__':
+        return profiler.__all__
+    if name in profiler.__all__:
+        return getattr(profiler, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
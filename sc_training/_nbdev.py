@@ -3,44 +3,89 @@
 __all__ = ["index", "modules", "custom_doc_links", "git_url"]
 
 index = {"Player_data": "01_summarise_rpl.ipynb",
+         "is_eligible_name": "01_summarise_rpl.ipynb",
+         "INELIGIBLE_NAME_PATTERNS": "01_summarise_rpl.ipynb",
          "Replay_data": "01_summarise_rpl.ipynb",
          "get_players": "01_summarise_rpl.ipynb",
          "get_winner": "01_summarise_rpl.ipynb",
          "get_replay_info": "01_summarise_rpl.ipynb",
          "INTERVALS_BASE": "02_handle_tracker_events.ipynb",
+         "Game_stages": "02_handle_tracker_events.ipynb",
+         "GAME_STAGES": "02_handle_tracker_events.ipynb",
+         "index_events": "02_handle_tracker_events.ipynb",
+         "get_events": "02_handle_tracker_events.ipynb",
+         "Replay_timeline": "02_handle_tracker_events.ipynb",
+         "get_timeline": "02_handle_tracker_events.ipynb",
          "calc_realtime_index": "02_handle_tracker_events.ipynb",
+         "cached_intermediate": "02_handle_tracker_events.ipynb",
+         "Data_table": "02_handle_tracker_events.ipynb",
+         "register_plugin": "02_handle_tracker_events.ipynb",
          "get_pstatse": "03_macro_econ_parser.ipynb",
-         "complete_pstatse_df": "03_macro_econ_parser.ipynb",
+         "get_pstatse_columns": "03_macro_econ_parser.ipynb",
+         "PSTATSE_COLUMNS": "03_macro_econ_parser.ipynb",
          "get_subdf_mean": "03_macro_econ_parser.ipynb",
          "get_subdf_total": "03_macro_econ_parser.ipynb",
+         "calc_capped_lapses": "03_macro_econ_parser.ipynb",
          "get_cappedTime": "03_macro_econ_parser.ipynb",
+         "get_capped_episodes": "03_macro_econ_parser.ipynb",
+         "get_longest_capped_time": "03_macro_econ_parser.ipynb",
          "calculate_spending_coeficient": "03_macro_econ_parser.ipynb",
          "get_player_macro_econ_df": "03_macro_econ_parser.ipynb",
          "gen_interval_sub_dfs": "03_macro_econ_parser.ipynb",
          "list_attr_interval_values": "03_macro_econ_parser.ipynb",
+         "get_stage_intervals": "03_macro_econ_parser.ipynb",
+         "get_stage_masks": "03_macro_econ_parser.ipynb",
+         "stage_means": "03_macro_econ_parser.ipynb",
+         "stage_totals": "03_macro_econ_parser.ipynb",
+         "aggregate_stages": "03_macro_econ_parser.ipynb",
+         "STAGE_REDUCERS": "03_macro_econ_parser.ipynb",
          "get_player_macro_econ_stats": "03_macro_econ_parser.ipynb",
+         "UNIT_NAMES": "04_build_parser.ipynb",
+         "CHANGE_NAMES": "04_build_parser.ipynb",
+         "RACE_ARMIES": "04_build_parser.ipynb",
+         "RACE_BUILDINGS": "04_build_parser.ipynb",
+         "RACE_UPGRADES": "04_build_parser.ipynb",
          "BASES": "04_build_parser.ipynb",
+         "EXPANSION_COUNT_NAMES": "04_build_parser.ipynb",
+         "Unit_classifier": "04_build_parser.ipynb",
+         "get_unit_classifier": "04_build_parser.ipynb",
          "composition_df": "04_build_parser.ipynb",
          "count_active_units": "04_build_parser.ipynb",
          "complete_count": "04_build_parser.ipynb",
+         "get_unit_times": "04_build_parser.ipynb",
+         "Unit_lifetimes": "04_build_parser.ipynb",
+         "unit_lifetimes": "04_build_parser.ipynb",
          "count_composition": "04_build_parser.ipynb",
          "count_started": "04_build_parser.ipynb",
          "get_expan_times": "04_build_parser.ipynb",
          "get_expan_counts": "04_build_parser.ipynb",
          "list_player_upgrades": "04_build_parser.ipynb",
+         "get_special_abilities": "05_handle_command_events.ipynb",
+         "ABILITIES": "05_handle_command_events.ipynb",
          "COMMON_ABILITIES": "05_handle_command_events.ipynb",
-         "MOVE_COMMAND": "05_handle_command_events.ipynb",
-         "reindex": "05_handle_command_events.ipynb",
-         "average": "05_handle_command_events.ipynb",
+         "get_action_seconds": "05_handle_command_events.ipynb",
+         "weigh_actions": "05_handle_command_events.ipynb",
+         "bin_actions": "05_handle_command_events.ipynb",
+         "calc_average_rate": "05_handle_command_events.ipynb",
+         "ACTION_EVENTS": "05_handle_command_events.ipynb",
+         "EFFECTIVE_EVENTS": "05_handle_command_events.ipynb",
+         "ACTION_WEIGHT": "05_handle_command_events.ipynb",
+         "calc_action_rates": "05_handle_command_events.ipynb",
          "calc_apms": "05_handle_command_events.ipynb",
-         "build_commands_df": "05_handle_command_events.ipynb",
+         "Command_table": "05_handle_command_events.ipynb",
+         "get_commands_table": "05_handle_command_events.ipynb",
          "calc_spe_abil_ratios": "05_handle_command_events.ipynb",
          "get_top_abilities": "05_handle_command_events.ipynb",
          "get_prefered_spec_abil": "05_handle_command_events.ipynb",
          "calc_attack_ratio": "05_handle_command_events.ipynb",
+         "Ctrl_group_history": "06_selection_parser.ipynb",
          "CtrlGroupTracker": "06_selection_parser.ipynb",
-         "count_active_groups": "06_selection_parser.ipynb",
-         "build_ctrlg_df": "06_selection_parser.ipynb",
+         "Selection_table": "06_selection_parser.ipynb",
+         "get_selection_tables": "06_selection_parser.ipynb",
+         "get_selection_table": "06_selection_parser.ipynb",
+         "count_selection_seconds": "06_selection_parser.ipynb",
+         "selection_ratios": "06_selection_parser.ipynb",
+         "SELECTION_EVENTS": "06_selection_parser.ipynb",
          "count_max_active_groups": "06_selection_parser.ipynb",
          "calc_ctrlg_ratio": "06_selection_parser.ipynb",
          "calc_get_ctrl_grp_ratio": "06_selection_parser.ipynb",
@@ -51,15 +96,61 @@ index = {"Player_data": "01_summarise_rpl.ipynb",
          "Config_settings": "07_ingest.ipynb",
          "load_configurations": "07_ingest.ipynb",
          "flatten_indicators": "07_ingest.ipynb",
+         "ensure_indexes": "07_ingest.ipynb",
+         "DB_INDEXES": "07_ingest.ipynb",
          "set_up_db": "07_ingest.ipynb",
+         "index_usage_stats": "07_ingest.ipynb",
          "verify_replays_path": "07_ingest.ipynb",
+         "Indicator": "07_ingest.ipynb",
+         "INTERMEDIATES": "07_ingest.ipynb",
+         "INDICATORS": "07_ingest.ipynb",
+         "Ingest_timings": "07_ingest.ipynb",
+         "select_indicators": "07_ingest.ipynb",
+         "extract_indicators": "07_ingest.ipynb",
          "build_indicators": "07_ingest.ipynb",
+         "encode_column": "07_ingest.ipynb",
+         "decode_column": "07_ingest.ipynb",
+         "extract_economy": "07_ingest.ipynb",
+         "load_economy": "07_ingest.ipynb",
+         "Processed_replay": "07_ingest.ipynb",
+         "extract_replay_economy": "07_ingest.ipynb",
+         "process_replay_file": "07_ingest.ipynb",
+         "Bulk_writer": "07_ingest.ipynb",
+         "Bloom_filter": "07_ingest.ipynb",
+         "load_known_replays": "07_ingest.ipynb",
+         "filter_new_replays": "07_ingest.ipynb",
+         "process_replay_files": "07_ingest.ipynb",
+         "Ingest_summary": "07_ingest.ipynb",
+         "ingest_replay_files": "07_ingest.ipynb",
          "inventory_replays": "07_ingest.ipynb",
+         "file_hash": "07_ingest.ipynb",
+         "Replay_manifest": "07_ingest.ipynb",
+         "watch_replays": "07_ingest.ipynb",
+         "extract_event_columns": "07_ingest.ipynb",
+         "Cached_replay": "07_ingest.ipynb",
+         "Event_cache": "07_ingest.ipynb",
+         "rescore_cached_replay": "07_ingest.ipynb",
+         "rescore_replays": "07_ingest.ipynb",
          "get_top_of_category": "08_profiler.ipynb",
          "get_user_name_list": "08_profiler.ipynb",
          "get_player_replays": "08_profiler.ipynb",
          "build_profile": "08_profiler.ipynb",
-         "build_player_race_profiles": "08_profiler.ipynb"}
+         "build_player_race_profiles": "08_profiler.ipynb",
+         "Benchmark_stats": "09_benchmarks.ipynb",
+         "Benchmark_recorder": "09_benchmarks.ipynb",
+         "reset_replay": "09_benchmarks.ipynb",
+         "connect_benchmark_db": "09_benchmarks.ipynb",
+         "import_package": "09_benchmarks.ipynb",
+         "benchmark_replay": "09_benchmarks.ipynb",
+         "format_results": "09_benchmarks.ipynb",
+         "run_benchmarks": "09_benchmarks.ipynb",
+         "compare_benchmarks": "09_benchmarks.ipynb",
+         "benchmark_cli": "09_benchmarks.ipynb",
+         "try_process_replay_file": "07_ingest.ipynb",
+         "find_known_replays": "07_ingest.ipynb",
+         "partial_stages": "06_selection_parser.ipynb",
+         "EVENT_CACHE_VERSION": "07_ingest.ipynb",
+         "set_up_plugins": "06_selection_parser.ipynb"}
 
 modules = ["ingest/summarise_rpl.py",
            "ingest/handle_tracker_event.py",
@@ -68,7 +159,8 @@ modules = ["ingest/summarise_rpl.py",
            "ingest/handle_command_events.py",
            "ingest/selection_parser.py",
            "ingest/ingest.py",
-           "profiler.py"]
+           "profiler.py",
+           "benchmarks.py"]
 
 doc_url = "https://HDavidEspinosa.github.io/sc_training/"
 
@@ -0,0 +1,316 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: 09_benchmarks.ipynb (unless otherwise specified).
+
+__all__ = ['Benchmark_stats', 'run_benchmarks', 'compare_benchmarks', 'benchmark_cli']
+
+# Internal Cell
+import sc2reader
+import pymongo
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import numpy as np
+
+from typing import *
+from pathlib import Path
+from datetime import datetime
+from functools import partial
+from dataclasses import dataclass, asdict
+
+from .ingest import *
+from .ingest.ingest import build_indicators, extract_indicators
+from .profiler import build_player_race_profiles
+
+# Cell
+@dataclass
+class Benchmark_stats:
+    """Summary of the times measured for a step of the benchmark suite.
+
+    *Attributes*
+        - count (int)
+            Number of successful calls measured.
+        - errors (int)
+            Number of calls that raised an exception.
+        - total, mean, median, minimum, maximum (Optional[float])
+            Statistics of the calls' wall times in seconds. None if no
+            call was measured.
+        - p90, p95, p99 (Optional[float])
+            90th, 95th and 99th percentiles of the wall times.
+    """
+    count: int
+    errors: int = 0
+    total: Optional[float] = None
+    mean: Optional[float] = None
+    median: Optional[float] = None
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+    p90: Optional[float] = None
+    p95: Optional[float] = None
+    p99: Optional[float] = None
+
+    @classmethod
+    def from_samples(cls, samples: Sequence[float],
+                     errors: int = 0) -> 'Benchmark_stats':
+        """Summarises a list of wall times."""
+        if not len(samples):
+            return cls(0, errors)
+
+        times = np.asarray(samples, dtype=float)
+        p90, p95, p99 = np.percentile(times, [90, 95, 99])
+        return cls(len(times), errors,
+                   float(times.sum()), float(times.mean()),
+                   float(np.median(times)), float(times.min()),
+                   float(times.max()), float(p90), float(p95), float(p99))
+
+# Internal Cell
+class Benchmark_recorder:
+    """Stores the wall times of the calls of each benchmarked step."""
+    def __init__(self):
+        self.samples = dict()
+        self.errors = dict()
+
+    def measure(self, step: str, func: Callable, *args, **kwargs) -> Any:
+        """Calls func with the arguments and records its wall time under
+        step. Returns the function's result, or None if it fails."""
+        self.samples.setdefault(step, [])
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.errors[step] = self.errors.get(step, 0) + 1
+            return None
+        self.samples[step].append(time.perf_counter() - start)
+        return result
+
+    def stats(self) -> dict[str, Benchmark_stats]:
+        """Summarises the times of each step."""
+        return {step: Benchmark_stats.from_samples(samples,
+                                                   self.errors.get(step, 0))
+                for step, samples in self.samples.items()}
+
+
+# Helper function that drops the tables and indexes stored in a replay by
+# the ingest functions, so the next measurement starts from its events.
+def reset_replay(rpl: sc2reader.resources.Replay,
+                 keep_index: bool = False) -> None:
+    attributes = (['intermediates'] if keep_index
+                  else ['intermediates', 'event_index', 'timeline'])
+    for attribute in attributes:
+        rpl.__dict__.pop(attribute, None)
+
+
+# Helper function that connects to the scratch database of the suite.
+# Returns None if the server is not reachable.
+def connect_benchmark_db(mongo_uri: Optional[str], db_name: str) \
+                         -> Optional[pymongo.database.Database]:
+    if mongo_uri is None:
+        return None
+    client = pymongo.MongoClient(mongo_uri, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+    except pymongo.errors.PyMongoError as err:
+        print(f'Skipping the database benchmarks: {err}')
+        return None
+    client.drop_database(db_name)
+    working_db = client[db_name]
+    ensure_indexes(working_db)
+    return working_db
+
+
+# Helper function that imports the package in a new interpreter, as a
+# short-lived command or a new worker process does.
+def import_package(statement: str = 'from sc_training.ingest import *') \
+                   -> None:
+    subprocess.run([sys.executable, '-c', statement], check=True,
+                   capture_output=True)
+
+
+# Helper function that measures the steps of the suite on a replay file.
+def benchmark_replay(rpl_file: str, recorder: Benchmark_recorder,
+                     repeat: int = 1,
+                     working_db: Optional[pymongo.database.Database] = None)\
+                     -> None:
+    for _ in range(repeat):
+        rpl = recorder.measure('load_replay', sc2reader.load_replay,
+                               rpl_file)
+    if rpl is None:
+        return
+
+    recorder.measure('index_events', index_events, rpl)
+    get_timeline(rpl)
+    for indicator in INDICATORS.values():
+        func = partial(indicator.func, **indicator.kwargs)
+        for _ in range(repeat):
+            for pid in rpl.player:
+                reset_replay(rpl, keep_index=True)
+                recorder.measure(indicator.name, func, rpl, pid)
+
+    for _ in range(repeat):
+        reset_replay(rpl)
+        recorder.measure('extract_indicators', extract_indicators, rpl)
+
+    if working_db is not None:
+        working_db['replays'].insert_one(asdict(get_replay_info(rpl)))
+        for _ in range(repeat):
+            reset_replay(rpl)
+            working_db['indicators'].delete_many({'replay_name':
+                                                  rpl.filename})
+            recorder.measure('build_indicators', build_indicators, rpl,
+                             working_db)
+
+
+# Helper function that formats the results of a run as a table.
+def format_results(results: dict[str, Any]) -> str:
+    table = pd.DataFrame(results['results']).T
+    table = table[['count', 'errors', 'median', 'p90', 'p95', 'p99',
+                   'total']]
+    table[['count', 'errors']] = table[['count', 'errors']].astype(int)
+    for column in ['median', 'p90', 'p95', 'p99']:
+        table[column] = table[column].astype(float) * 1000
+    return (table.rename(columns={'median': 'median (ms)', 'p90': 'p90 (ms)',
+                                  'p95': 'p95 (ms)', 'p99': 'p99 (ms)',
+                                  'total': 'total (s)'})
+                 .to_string(float_format='{:.2f}'.format))
+
+# Cell
+def run_benchmarks(replays_path: Union[str, Path] = 'test_replays',
+                   output: Optional[Union[str, Path]] = None,
+                   repeat: int = 1,
+                   mongo_uri: Optional[str] = 'mongodb://localhost:27017',
+                   db_name: str = 'sc_training_benchmark',
+                   max_replays: Optional[int] = None) -> dict[str, Any]:
+    """Runs the benchmark suite over the replays in a directory and its
+    subdirectories.
+
+    *Args*
+        - replays_path (Union[str, Path] = 'test_replays')
+            Directory that contains the replays.
+        - output (Union[str, Path], optional)
+            JSON file where the results are stored.
+        - repeat (int = 1)
+            Number of times each step is measured on each replay.
+        - mongo_uri (str, optional)
+            URI of the MongoDB server used by the database steps. If None,
+            these steps are skipped.
+        - db_name (str = 'sc_training_benchmark')
+            Name of the scratch database. It is dropped before and after
+            the run.
+        - max_replays (int, optional)
+            Maximum number of replays to use.
+
+    *Returns*
+        - dict[str, Any]
+            The results, with the same structure as the JSON file.
+
+    *Errors*
+        - ValueError
+            If repeat is smaller than 1.
+    """
+    if repeat < 1:
+        raise ValueError(f'repeat must be 1 or greater, not {repeat}')
+
+    rpl_files = sorted(sc2reader.utils.get_files(str(replays_path),
+                                                 extension='SC2Replay'))
+    rpl_files = rpl_files[:max_replays]
+    working_db = connect_benchmark_db(mongo_uri, db_name)
+    recorder = Benchmark_recorder()
+    set_up_plugins()
+
+    print(f'Benchmarking {len(rpl_files)} replays at: {replays_path}')
+    start = time.perf_counter()
+    for _ in range(repeat):
+        recorder.measure('import_package', import_package)
+    for rpl_file in rpl_files:
+        benchmark_replay(rpl_file, recorder, repeat, working_db)
+
+    index_usage = []
+    if working_db is not None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                recorder.measure('build_player_race_profiles',
+                                 build_player_race_profiles, working_db)
+        index_usage = (index_usage_stats(working_db)
+                       [['collection', 'index', 'ops']]
+                       .to_dict('records'))
+        working_db.client.drop_database(db_name)
+    print(f'Benchmark complete in {time.perf_counter() - start:.1f} seconds')
+
+    results = {'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'sc2reader': sc2reader.__version__,
+               'replays': len(rpl_files),
+               'repeat': repeat,
+               'results': {step: asdict(stats)
+                           for step, stats in recorder.stats().items()},
+               'index_usage': index_usage}
+
+    print(format_results(results))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    return results
+
+
+# Cell
+def compare_benchmarks(baseline: Union[str, Path, dict],
+                       current: Union[str, Path, dict],
+                       statistic: str = 'median') -> pd.DataFrame:
+    """Compares a statistic of the steps of two benchmark runs.
+
+    *Args*
+        - baseline (Union[str, Path, dict])
+            Results of the reference run, or the JSON file that stores
+            them.
+        - current (Union[str, Path, dict])
+            Results of the run that is compared with the reference.
+        - statistic (str = 'median')
+            Name of the `Benchmark_stats` attribute that is compared.
+
+    *Returns*
+        - pd.DataFrame
+            Table indexed by step with the statistic of each run and the
+            ratio between them (current / baseline).
+    """
+    runs = []
+    for run in (baseline, current):
+        if not isinstance(run, dict):
+            with open(run) as f:
+                run = json.load(f)
+        runs.append(pd.Series({step: stats[statistic]
+                               for step, stats in run['results'].items()},
+                              dtype=float))
+
+    comparison = pd.DataFrame({'baseline': runs[0], 'current': runs[1]})
+    comparison['ratio'] = comparison['current'] / comparison['baseline']
+    return comparison
+
+# Cell
+def benchmark_cli(args: Optional[list[str]] = None) -> None:
+    """Command line entry point of the benchmark suite (see
+    `run_benchmarks`)."""
+    parser = argparse.ArgumentParser(
+                description='Benchmark the sc_training ingest functions.')
+    parser.add_argument('replays_path', nargs='?', default='test_replays',
+                        help='directory that contains the replays')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='JSON file where the results are stored')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of measurements per replay')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017',
+                        help='MongoDB server used by the database steps')
+    parser.add_argument('--no-db', action='store_true',
+                        help='skip the steps that need a database')
+    parser.add_argument('--max-replays', type=int, default=None,
+                        help='maximum number of replays to use')
+    parsed = parser.parse_args(args)
+
+    run_benchmarks(parsed.replays_path, parsed.output, parsed.repeat,
+                   None if parsed.no_db else parsed.mongo_uri,
+                   max_replays=parsed.max_replays)
\ No newline at end of file
@@ -1,7 +1,30 @@
-from sc_training.ingest.summarise_rpl import *
-from sc_training.ingest.handle_tracker_event import *
-from sc_training.ingest.macro_econ_parser import *
-from sc_training.ingest.build_parser import *
-from sc_training.ingest.handle_command_events import *
-from sc_training.ingest.selection_parser import *
-from sc_training.ingest.ingest import *
\ No newline at end of file
+import importlib
+
+# Modules of the package, in dependency order. Each one is only imported
+# the first time one of its names is used.
+_MODULES = ['summarise_rpl',
+            'handle_tracker_event',
+            'macro_econ_parser',
+            'build_parser',
+            'handle_command_events',
+            'selection_parser',
+            'ingest']
+
+
+def __getattr__(name):
+    if name.startswith('__') and name != '__all__':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    if name in _MODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+
+    names = []
+    for module_name in _MODULES:
+        module = importlib.import_module(f'{__name__}.{module_name}')
+        if name in module.__all__:
+            return getattr(module, name)
+        names.extend(module.__all__)
+
+    if name == '__all__':
+        return names
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
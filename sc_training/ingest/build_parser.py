@@ -1,6 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 04_build_parser.ipynb (unless otherwise specified).
 
-__all__ = ['count_composition', 'count_started', 'get_expan_times', 'get_expan_counts', 'list_player_upgrades']
+__all__ = ['Unit_lifetimes', 'unit_lifetimes', 'count_composition', 'count_started', 'get_expan_times',
+           'get_expan_counts', 'list_player_upgrades']
 
 # Internal Cell
 
@@ -10,12 +11,11 @@ from pprint import pprint
 from dataclasses import dataclass, astuple, field
 from datetime import datetime
 from typing import *
-from fastcore import test as ft
-from itertools import zip_longest
+from itertools import zip_longest, chain
+from functools import lru_cache
 
 import pandas as pd
 import numpy as np
-import csv
 import json
 
 # Internal Cell
@@ -28,37 +28,82 @@ from .macro_econ_parser import *
 
 # Internal Cell
 
-# Load data files
-if __name__ == "__main__":
-    data_path = Path(Path.cwd()/'data')
+# Data tables, read from the project's data folder on first use
+UNIT_NAMES = Data_table('unit_names.csv')
 
-else:
-    data_path = (Path(Path(__file__)/'data')
-            if Path(Path(__file__)/'data').exists()
-            else Path(Path(__file__)/'../../../data'))
+CHANGE_NAMES = Data_table('changes_names.csv')
 
-with open(data_path/'unit_names.csv') as f:
-    file_reader = csv.reader(f)
-    UNIT_NAMES = next(file_reader)
+RACE_ARMIES = Data_table('army_list.json')
 
-# with open(data_path/'changes_names.csv') as f:
-#     file_reader = csv.reader(f)
-#     change_names = next(file_reader)
+RACE_BUILDINGS = Data_table('buildings_list.json')
 
-with open(data_path/'army_list.json') as f:
-    RACE_ARMIES = json.load(f)
-
-with open(data_path/'buildings_list.json') as f:
-    RACE_BUILDINGS = json.load(f)
-
-with open(data_path/'upgrades.json') as f:
-    RACE_UPGRADES = json.load(f)
+RACE_UPGRADES = Data_table('upgrades.json')
 
 BASES = {'Protoss': ['nexus'],
         'Zerg': ['hatchery', 'lair', 'hive'],
         'Terran':['commandcenter']}
 
+# Keys of the base counts of the default game stages (see get_expan_counts)
+EXPANSION_COUNT_NAMES = {'whole': 'total_expan',
+                         'early': 'earlyg_expan',
+                         'mid': 'midg_expan',
+                         'late': 'lateg_expan'}
+
+# Internal Cell
+class Unit_classifier:
+    """Classifies the unit type names recorded by sc2reader into the names
+    of a race's army or buildings list.
+
+    A unit type belongs to every name of the list that is contained in its
+    lowercase name (e.g. *SiegeTankSieged* is a *siegetank*), so a few
+    types, like *InfestorBurrowed*, belong to more than one. Terran tech
+    labs and reactors only belong to the `techlab` or `reactor` names,
+    even if their types include the name of the building they expand.
+
+    *Args*
+        - race (str)
+            The race whose list is used.
+        - buildings (bool = False)
+            If True, the classifier uses the race's buildings list,
+            otherwise it uses its army list.
+    """
+    def __init__(self, race: str, buildings: bool = False):
+        self.names = RACE_BUILDINGS[race] if buildings else RACE_ARMIES[race]
+        self.add_ons = race == 'Terran' and buildings
+
+        # Unit type names (in lowercase) and their list names
+        self.categories = {type_name: self.match(type_name)
+                           for type_name in chain(self.names, CHANGE_NAMES)}
+
+    def match(self, type_name: str) -> tuple[str, ...]:
+        """Lists the names of the list contained in a lowercase unit type
+        name, in the order of the list.
+        """
+        categories = tuple(name for name in self.names if name in type_name)
+        if self.add_ons and categories:
+            if 'reactor' in type_name:
+                return ('reactor',)
+            if 'techlab' in type_name:
+                return ('techlab',)
+            return categories[-1:]
+        return categories
+
+    def __getitem__(self, type_name: str) -> tuple[str, ...]:
+        type_name = type_name.lower()
+        categories = self.categories.get(type_name)
+        if categories is None:
+            categories = self.categories[type_name] = self.match(type_name)
+        return categories
+
+# Helper function that returns the classifier of a race's army or buildings
+# list, which is only built once.
+@lru_cache(maxsize=None)
+def get_unit_classifier(race: str, buildings: bool = False) \
+                        -> Unit_classifier:
+    return Unit_classifier(race, buildings)
+
 # Internal Cell
+@cached_intermediate
 def composition_df(rpl: sc2reader.resources.Replay,
                    pid: int, buildings:bool=False) -> pd.DataFrame:
     """Generates a DataFrame that stores the spawning information of each
@@ -86,51 +131,36 @@ def composition_df(rpl: sc2reader.resources.Replay,
     """
     p_race = rpl.player[pid].play_race
 
-    # Get the player's race list of army or building units.
-    u_list = RACE_BUILDINGS[p_race] if buildings else RACE_ARMIES[p_race]
+    # Get the classifier of the player's race list of army or building
+    # units.
+    classifier = get_unit_classifier(p_race, buildings)
 
     # Get the player's units-list.
     player_units = [(uname, u, u.id) for u in rpl.player[pid].units
-                    for uname in u_list
-                    if uname in u.name.lower()
-                    and (('hallucinated' not in u.__dict__)
-                         or ('hallucinated' in u.__dict__
-                             and u.hallucinated == False))
-                    and u.is_building == buildings]
-
-    player_units_df = pd.DataFrame({
+                    if u.is_building == buildings
+                    and u.__dict__.get('hallucinated', False) == False
+                    for uname in classifier[u.name]]
+
+    # Convert the units' frames to real time indexes in a single call per
+    # column. Units that never finished or died keep pd.NaT.
+    timeline = get_timeline(rpl)
+    frames = np.array([[u.started_at,
+                        u.finished_at if u.finished_at != None else np.nan,
+                        u.died_at if u.died_at != None else np.nan]
+                       for uname, u, id in player_units],
+                      dtype=float).reshape(-1, 3)
+    started, finished, died = timeline.frames_to_realtime(frames).T
+
+    # Generate and return the DataFrame with info from the units. The
+    # classifier already corrects the double count of Terran add-ons.
+    return pd.DataFrame({
         'Unit':[uname for uname, u, id in player_units],
-        'Uname': [u.name for uname, u, id in player_units],
-        'UnitID':[id for uname, u, id in player_units],
-        'started_building':[calc_realtime_index((u.started_at/rpl.game_fps),
-                                                rpl)
-                            for uname, u, id in player_units],
-        'enter_game_time': [calc_realtime_index((u.finished_at/rpl.game_fps),
-                                                rpl)
-                            if u.finished_at != None else pd.NaT
-                            for uname, u, id in player_units],
-        'died_time': [calc_realtime_index((u.died_at/rpl.game_fps), rpl)
-                      if u.died_at != None else pd.NaT
-                      for uname, u, id in player_units]
+        'started_building': started,
+        'enter_game_time': [t if not np.isnan(t) else pd.NaT
+                            for t in finished],
+        'died_time': [t if not np.isnan(t) else pd.NaT for t in died]
     })
 
-    if p_race == 'Terran' and buildings:
-        # Correct double count for tech labs
-        player_units_df.drop_duplicates(subset='UnitID',
-                                        keep='last',
-                                        inplace=True)
-
-        # Correct misslabeling of reactors
-        player_units_df.loc[player_units_df['Uname'].\
-            str.contains('TechLab'), 'Unit'] = 'techlab'
-        player_units_df.loc[player_units_df['Uname'].\
-            str.contains('Reactor'), 'Unit'] = 'reactor'
-
-
-
-    # Generate and return the DataFrame with info from the units.
-    return player_units_df.drop(['Uname', 'UnitID'], axis=1)
-
 # Internal Cell
 def count_active_units(df: pd.DataFrame,
                        end: float, start:float = 0) -> pd.DataFrame:
@@ -225,18 +255,152 @@ def complete_count(compositions:list[pd.DataFrame],
             for unit in unit_list[player_race]}
             for compo in compositions]
 
+# Internal Cell
+# Helper function that converts a time column of a units' DataFrame (see
+# composition_df) to an array, where pd.NaT becomes np.nan.
+def get_unit_times(units_df: pd.DataFrame, column: str) -> np.ndarray:
+    return pd.to_numeric(units_df[column], errors='coerce').to_numpy(float)
+
+# Cell
+class Unit_lifetimes:
+    """Index of the times at which a player's units of each type started,
+    were born (completed) and died.
+
+    The index keeps a sorted array of times per unit type and event, so
+    it counts the units of every type at any number of times with binary
+    searches, without filtering the units' DataFrame.
+
+    *Args*
+        - units_df (pd.DataFrame)
+            DataFrame of a player's units' start and finish spawning, and
+            death times (see `composition_df` function).
+        - unit_list (list[str])
+            Unit types that are counted. Units of other types are ignored.
+    """
+    events = ('started', 'born', 'died')
+
+    def __init__(self, units_df: pd.DataFrame, unit_list: list[str]):
+        self.unit_list = list(unit_list)
+        self.codes = pd.Index(self.unit_list).get_indexer(units_df['Unit'])
+
+        started = get_unit_times(units_df, 'started_building')
+        born = get_unit_times(units_df, 'enter_game_time')
+        died = get_unit_times(units_df, 'died_time')
+        self.times = {'started': self.sort_times(started),
+                      'born': self.sort_times(born),
+                      'died': self.sort_times(died)}
+
+        # An active unit must also have started, so alive counts a birth or
+        # death when both the unit's start and the event have happened.
+        self.active_times = [
+            self.sort_times(np.where(times > 0,
+                                     np.maximum(times, started), np.nan))
+            for times in (born, died)]
+
+    # Helper method that splits the times of the units by type and sorts
+    # them, leaving out the units without a time.
+    def sort_times(self, times: np.ndarray) -> list[np.ndarray]:
+        return [np.sort(times[(self.codes == code) & ~np.isnan(times)])
+                for code in range(len(self.unit_list))]
+
+    # Helper method that counts, for each time in ends, the times of each
+    # unit type that are smaller than or equal to it.
+    @staticmethod
+    def count_until(type_times: list[np.ndarray],
+                    ends: np.ndarray) -> np.ndarray:
+        return np.stack([np.searchsorted(times, ends, side='right')
+                         for times in type_times], axis=-1)
+
+    def count(self, event: str, end: Union[float, np.ndarray],
+              start: Union[float, np.ndarray] = 0) -> np.ndarray:
+        """Counts the units of each type that started, were born or died in
+        the (start, end] interval. Intervals that end before they start,
+        such as the stages a short match does not reach, count 0 units.
+
+        *Args*
+            - event (str)
+                'started', 'born' or 'died'.
+            - end (Union[float, np.ndarray])
+                End of the interval, or array of interval ends.
+            - start (Union[float, np.ndarray] = 0)
+                Start of the interval, or array of interval starts. If not
+                defined, the units are counted from the begining of the
+                match.
+
+        *Returns*
+            - np.ndarray
+                Counts with a column per unit type of `unit_list`, and a
+                row per interval if `end` or `start` are arrays.
+
+        *Errors*
+            - ValueError
+                If `event` is not one of the events in the index.
+        """
+        if event not in self.times:
+            raise ValueError(f'Unknown event {event!r}, expected one of '
+                             f'{self.events}')
+
+        type_times = self.times[event]
+        start = np.asarray(start, dtype=float)
+        end = np.maximum(np.asarray(end, dtype=float), start)
+        return (self.count_until(type_times, end)
+                - self.count_until(type_times, start))
+
+    def alive(self, time: Union[float, np.ndarray]) -> np.ndarray:
+        """Counts the active units of each type at a time of the match,
+        i.e. the units that started and were born but did not die before
+        that time.
+
+        *Args*
+            - time (Union[float, np.ndarray])
+                Time of the match, or array of times, in seconds.
+
+        *Returns*
+            - np.ndarray
+                Counts with a column per unit type of `unit_list`, and a
+                row per time if `time` is an array.
+        """
+        time = np.asarray(time, dtype=float)
+        born, died = self.active_times
+        return self.count_until(born, time) - self.count_until(died, time)
+
+@cached_intermediate
+def unit_lifetimes(rpl: sc2reader.resources.Replay,
+                   pid: int, buildings: bool = False) -> Unit_lifetimes:
+    """Builds the `Unit_lifetimes` index of a player's army or building
+    units, with a column for each unit type of the player's race.
+
+    *Args*
+        - rpl (sc2reader.resources.Replay)
+            The match's replay object.
+        - pid (int)
+            The player's match id.
+        - buildings (bool = False)
+            If True, the index holds the player's buildings, otherwise it
+            holds their army units.
+
+    *Returns*
+        - Unit_lifetimes
+            Index of the player's units.
+    """
+    player_race = rpl.player[pid].play_race
+    unit_list = (RACE_BUILDINGS if buildings else RACE_ARMIES)[player_race]
+    return Unit_lifetimes(composition_df(rpl, pid, buildings=buildings),
+                          unit_list)
+
 # Cell
 def count_composition(rpl: sc2reader.resources.Replay,
-                      pid: int, buildings:bool=False) \
+                      pid: int, buildings:bool=False,
+                      stages: Game_stages = GAME_STAGES) \
                       -> dict[str, dict[str, int]]:
     """Generate a tally of all of a player's active units at different
     stages of the match.
 
-    The function returns a dictionary of with four keys ('whole_comp',
-    'early_comp', 'mid_comp', 'late_comp') each of which refers to a
-    dictionary that stores pairs of 'unit_type' : 'active_unit_type_count`.
-    There are values for all player's race unit types, even if the player
-    has no active units of some types.
+    The function returns a dictionary with a key for each game stage (by
+    default 'whole_comp', 'early_comp', 'mid_comp', 'late_comp') each of
+    which refers to a dictionary that stores pairs of 'unit_type' :
+    'active_unit_type_count`. There are values for all player's race unit
+    types, even if the player has no active units of some types.
 
     *Args*
         - rpl (sc2reader.resources.Replay)
@@ -246,56 +410,42 @@ def count_composition(rpl: sc2reader.resources.Replay,
         - buildings (bool)=False
             Flag indicating if the function should count buildings (True)
             or troops (False)
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the units are counted.
 
     *Returns*
         - dict
             Tally of a player's active units during a match
     """
 
-    player_race = rpl.player[pid].play_race
-
-
     # In this function the intervals count the units from the begining of
     # the match to the end of the interval.
-    interval_marks = [rpl.length.seconds,
-                      INTERVALS_BASE,
-                      INTERVALS_BASE*2,
-                      rpl.length.seconds]
-
-    # The units_df contains all the units owned by player (pid) in a
-    # replay (rpl), with their birth and death times
-    units_df = composition_df(rpl, pid, buildings=buildings)
-
-    # Based on the interval_marks I devide and list the units_df into the
-    # corresponding sub-dataframes
-    dfs = [units_df.loc[units_df.started_building <= mark]
-           for mark in interval_marks]
-
-    # I use the count_active_units function to calculate the unit counts
-    # and extract the totals for the different intervals
-    compositions = [count_active_units(data, interval_mark)['total']
-                    for interval_mark, data in zip(interval_marks, dfs)]
+    _, interval_marks = stages.limits(rpl.length.seconds)
 
+    # The index holds all the units owned by player (pid) in a replay
+    # (rpl), with their start, birth and death times
+    lifetimes = unit_lifetimes(rpl, pid, buildings=buildings)
+    compositions = lifetimes.alive(interval_marks)
 
-    # I use the compositions to generate four dictionaries with the full
-    # army count which includes all possible units of all possible races.
-    fin_dict = complete_count(compositions, player_race, buildings)
-
-    indexes=['whole_comp', 'early_comp', 'mid_comp', 'late_comp']
-    return {name: comp for name, comp in zip(indexes,fin_dict)}
+    return {f'{name}_comp': {unit: int(count)
+                             for unit, count
+                             in zip(lifetimes.unit_list, counts)}
+            for name, counts in zip(stages.names, compositions)}
 
 # Cell
 def count_started(rpl: sc2reader.resources.Replay,
-                  pid: int, buildings:bool =False) \
+                  pid: int, buildings:bool =False,
+                  stages: Game_stages = GAME_STAGES) \
                   -> list[dict[str, int]]:
     """Generate a tally of all of a player's started units at different
     stages of the match.
 
-    The function returns a dictionary of with four keys ('whole_started',
-    'early_started', 'mid_started', 'late_started') each of which refers
-    to a dictionary that stores pairs of 'unit_type' :
-    'started_unit_type_count`. There are values for all player's race unit
-    types, even if the player has no units of some types.
+    The function returns a dictionary with a key for each game stage (by
+    default 'whole_started', 'early_started', 'mid_started',
+    'late_started') each of which refers to a dictionary that stores pairs
+    of 'unit_type' : 'started_unit_type_count`. There are values for all
+    player's race unit types, even if the player has no units of some
+    types.
 
     *Args*
         - rpl (sc2reader.resources.Replay)
@@ -305,38 +455,27 @@ def count_started(rpl: sc2reader.resources.Replay,
         - buildings (bool)=False
             Flag indicating if the function should count buildings (True)
             or troops (False)
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the units are counted.
 
     *Returns*
         dict
             Tally of a player's started units during a match
 
     """
-    player_race = rpl.player[pid].play_race
     # In this function the intervals count the units from the begining of
     # the interval to the end of the interval.
-    interval_marks = [(0, rpl.length.seconds),
-                      (0, INTERVALS_BASE),
-                      (INTERVALS_BASE, INTERVALS_BASE*2),
-                      (INTERVALS_BASE*2, rpl.length.seconds)]
-
-    # The units_df contains all the units owned by player (pid) in a
-    # replay (rpl), with their birth and death times
-    units_df = composition_df(rpl, pid, buildings=buildings)
-
-    #
-    army_counts = [count_active_units(units_df,
-                                      start= inter_start,
-                                      end=inter_end)['started']
-                   for inter_start, inter_end in interval_marks]
+    inter_starts, inter_ends = stages.limits(rpl.length.seconds)
 
-    indexes = ['whole_started',
-               'early_started',
-               'mid_started',
-               'late_started']
+    # The index holds all the units owned by player (pid) in a replay
+    # (rpl), with their start, birth and death times
+    lifetimes = unit_lifetimes(rpl, pid, buildings=buildings)
+    army_counts = lifetimes.count('started', inter_ends, inter_starts)
 
-    fin_dict = complete_count(army_counts, player_race, buildings)
-
-    return {name: comp for name, comp in zip(indexes,fin_dict)}
+    return {f'{name}_started': {unit: int(count)
+                                for unit, count
+                                in zip(lifetimes.unit_list, counts)}
+            for name, counts in zip(stages.names, army_counts)}
 
 # Cell
 def get_expan_times(rpl: sc2reader.resources.Replay,
@@ -391,7 +530,8 @@ def get_expan_times(rpl: sc2reader.resources.Replay,
 
 # Cell
 def get_expan_counts(rpl: sc2reader.resources.Replay,
-                        pid: int) -> dict[str, int]:
+                     pid: int,
+                     stages: Game_stages = GAME_STAGES) -> dict[str, int]:
     '''The function counts the number of base structures a player built
     at each game stage.
 
@@ -401,38 +541,26 @@ def get_expan_counts(rpl: sc2reader.resources.Replay,
         - pid (int)
             The match player ID for the player being consider in the
             analysis.
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the bases are counted.
 
     *Returns*
         - dict[str, int]
-            Dictionary containing the base count for the whole, early,
-            mid and late stages of the game.
+            Dictionary containing the base count for each stage of the
+            game, by default the whole, early, mid and late stages.
 
     '''
-
     units_df = composition_df(rpl, pid, buildings=True)
-    units_df['real_time'] = units_df['enter_game_time']
-
-    interval_units_dfs = gen_interval_sub_dfs(rpl.length.seconds,
-                                              units_df,
-                                              ['Unit','enter_game_time'])
-
-    expansion_count_names  = ['total_expan',
-                              'earlyg_expan',
-                              'midg_expan',
-                              'lateg_expan']
-
-    expansion_counts = dict()
-    for in_name, in_df in zip(expansion_count_names, interval_units_dfs):
-        interval_df = in_df.loc[units_df['Unit'].isin(BASES[rpl.
-                                                        player[pid].
-                                                        play_race])
-                                & units_df['enter_game_time'].ne(0)]
-
-        expansion_counts[in_name] = len(interval_df)
-
+    enter_time = get_unit_times(units_df, 'enter_game_time')
+    bases = (units_df['Unit'].isin(BASES[rpl.player[pid].play_race])
+                             .to_numpy()
+             & (enter_time != 0))
 
-    return expansion_counts
+    # Flag the bases finished in each stage, all stages at once.
+    stage_bases = stages.masks(enter_time, rpl.length.seconds) & bases
 
+    return {EXPANSION_COUNT_NAMES.get(name, f'{name}_expan'): int(count)
+            for name, count in zip(stages.names, stage_bases.sum(axis=1))}
 
 # Cell
 def list_player_upgrades(rpl: sc2reader.resources.Replay,
@@ -443,10 +571,9 @@ def list_player_upgrades(rpl: sc2reader.resources.Replay,
 
     upg_events = {upg_event.upgrade_type_name
         : calc_realtime_index(upg_event.second, rpl)
-        for upg_event in rpl.events
-        if isinstance(upg_event, sc2reader.events.tracker.UpgradeCompleteEvent)
-        and upg_event.pid == pid
-        and upg_event.upgrade_type_name in RACE_UPGRADES[player_race]}
+        for upg_event
+        in get_events(rpl, sc2reader.events.tracker.UpgradeCompleteEvent, pid)
+        if upg_event.upgrade_type_name in RACE_UPGRADES[player_race]}
 
     return {upgrade_name: upg_events.get(upgrade_name, 0)
             for upgrade_name in RACE_UPGRADES[player_race]}
\ No newline at end of file
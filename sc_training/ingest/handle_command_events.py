@@ -1,6 +1,6 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 05_handle_command_events.ipynb (unless otherwise specified).
 
-__all__ = ['calc_apms', 'calc_spe_abil_ratios', 'get_prefered_spec_abil', 'calc_attack_ratio']
+__all__ = ['calc_action_rates', 'calc_apms', 'calc_spe_abil_ratios', 'get_prefered_spec_abil', 'calc_attack_ratio']
 
 # Internal Cell
 
@@ -8,17 +8,15 @@ __all__ = ['calc_apms', 'calc_spe_abil_ratios', 'get_prefered_spec_abil', 'calc_
 from pathlib import Path
 from pprint import pprint
 from typing import *
+from dataclasses import dataclass
+from functools import lru_cache
 
-import json
 import pandas as pd
-import fastcore.test as ft
+import numpy as np
 
 
 # Internal Cell
 import sc2reader
-from sc2reader.engine.plugins import SelectionTracker, APMTracker
-sc2reader.engine.register_plugin(SelectionTracker())
-sc2reader.engine.register_plugin(APMTracker())
 
 from .handle_tracker_event import *
 from .macro_econ_parser import *
@@ -26,104 +24,268 @@ from .macro_econ_parser import *
 # Internal Cell
 #
 # Internal constants
-if __name__ == "__main__":
-    data_path = Path(Path.cwd()/'data')
+ABILITIES = Data_table('ability_list.json')
 
-else:
-    data_path = (Path(Path(__file__)/'data')
-            if Path(Path(__file__)/'data').exists()
-            else Path(Path(__file__)/'../../../data'))
+COMMON_ABILITIES = frozenset(['Attack',
+                              'Stop',
+                              'HoldPosition',
+                              'Patrol',
+                              'RightClick'])
 
-with open(data_path/'ability_list.json') as af:
-    ABILITIES = json.load(af)
+# Helper function that returns the set of a race's special abilities, i.e.
+# its abilities that are not common commands. Each set is only built once.
+@lru_cache(maxsize=None)
+def get_special_abilities(race: str) -> frozenset[str]:
+    return frozenset(ABILITIES[race]) - COMMON_ABILITIES
 
-COMMON_ABILITIES = ['Attack',
-                    'Stop',
-                    'HoldPosition',
-                    'Patrol',
-                    'RightClick']
+# Internal Cell
+# Events that count as actions, as in sc2reader's APMTracker plugin.
+ACTION_EVENTS = (sc2reader.events.game.CommandEvent,
+                 sc2reader.events.game.SelectionEvent,
+                 sc2reader.events.game.ControlGroupEvent)
+
+# Events that count as effective actions, which leave out the selections
+# and the control group recalls.
+EFFECTIVE_EVENTS = (sc2reader.events.game.CommandEvent,
+                    sc2reader.events.game.SetControlGroupEvent,
+                    sc2reader.events.game.AddToControlGroupEvent)
+
+# Weight of each action. A registered minute lasts 60/1.4 real seconds at
+# the Faster game speed, so APMTracker adds 1.4 per action to measure the
+# actions per real minute.
+ACTION_WEIGHT = 1.4
+
+# Helper function that lists the registered seconds of a player's actions.
+@cached_intermediate
+def get_action_seconds(rpl: sc2reader.resources.Replay,
+                       pid: int, effective: bool = False) -> np.ndarray:
+    event_classes = EFFECTIVE_EVENTS if effective else ACTION_EVENTS
+    return np.concatenate([
+        np.fromiter((event.second for event in get_events(rpl, cls, pid)),
+                    dtype=np.int64)
+        for cls in event_classes])
+
+# Helper function that weighs the action counts of several intervals. It
+# adds the weight of the actions one by one, as APMTracker does, so the
+# results match those of the plugin exactly.
+def weigh_actions(counts: np.ndarray) -> np.ndarray:
+    weights = np.full(counts.max(initial=0), ACTION_WEIGHT).cumsum()
+    return np.concatenate(([0.0], weights))[counts]
+
+# Helper function that sums the weighted actions of a player in intervals
+# of a given number of registered seconds.
+def bin_actions(rpl: sc2reader.resources.Replay, pid: int,
+                resolution: int, effective: bool) -> np.ndarray:
+    if resolution <= 0:
+        raise ValueError(f'The resolution must be positive, got '
+                         f'{resolution}')
+    seconds = get_action_seconds(rpl, pid, effective)
+    return weigh_actions(np.bincount(seconds // resolution))
+
+# Helper function that calculates a player's average actions per minute
+# over the time they played, as APMTracker calculates avg_apm.
+def calc_average_rate(rpl: sc2reader.resources.Replay,
+                      pid: int, effective: bool) -> float:
+    seconds = get_action_seconds(rpl, pid, effective)
+    if not len(seconds):
+        return 0
 
-MOVE_COMMAND = ['RightClick']
+    # The player plays until they leave the match.
+    leave_events = get_events(rpl, sc2reader.events.game.PlayerLeaveEvent,
+                              pid)
+    seconds_played = (leave_events[-1].second if leave_events
+                      else rpl.length.seconds)
 
-# Internal Cell
+    counts = np.bincount(seconds)
+    return (sum(weigh_actions(counts[counts > 0]).tolist())
+            / float(seconds_played) * 60)
 
-# Helper functions for calc_apms
-def reindex(rpl: sc2reader.resources.Replay, apm_dict:dict) -> dict:
-    """Uses a dictionary that contains the player's minute-to-minute average
-    APM of the player to compose a dictionary that uses the correct time
-    index for this values based on the match's extension"""
-    out_dict = {}
-    for m in apm_dict.keys():
-        real_t = calc_realtime_index(m, rpl)
-        out_dict[real_t] = apm_dict[m]
-
-    return out_dict
-
-def average(lst: list[float]) -> float:
-    """Calculates the average of a list of floats."""
-    if len(lst) != 0:
-        return sum(lst)/len(lst)
-    else:
-        return 0
+# Cell
+def calc_action_rates(rpl: sc2reader.resources.Replay,
+                      pid: int,
+                      resolution: int = 60,
+                      effective: bool = False) -> pd.Series:
+    """Measures a player's actions per minute (APM) in consecutive
+    intervals of the match.
+
+    An action is any command, selection or control group event of the
+    player, as in sc2reader's APMTracker plugin. The effective actions
+    (EPM) leave out the selections and the control group recalls.
+
+    *Args*
+        - rpl (sc2reader.resources.Replay)
+            Replay being analysed
+        - pid (int)
+            Player id of the player being considered by the function
+        - resolution (int = 60)
+            Length of the intervals in the replay's registered seconds.
+            The default matches the per-minute APMs of APMTracker.
+        - effective (bool = False)
+            If True, only the effective actions are counted.
 
+    *Returns*
+        - pd.Series
+            Actions per minute in each interval, indexed by the real time
+            at which the interval starts, in seconds.
+
+    *Errors*
+        - ValueError
+            If the resolution is not positive.
+    """
+    rates = bin_actions(rpl, pid, resolution, effective)*(60/resolution)
+    starts = get_timeline(rpl).to_realtime(np.arange(len(rates))*resolution)
+    return pd.Series(rates, index=pd.Index(starts, name='real_time'),
+                     name='EPM' if effective else 'APM')
 
 # Cell
 def calc_apms(rpl: sc2reader.resources.Replay,
-             pid: int) -> dict[str, float]:
+             pid: int,
+             stages: Game_stages = GAME_STAGES,
+             resolution: int = 60,
+             effective: bool = False) -> dict[str, float]:
     """Extracts the average APM of a specific player during the whole game
     and the early, mid and late stages of the game.
 
-    The function uses sc2reader APMTracker plugin to extract the
-    minute-to-minute APM measurement of the player. Based on this it
-    calculates the average values for the whole, early, mid and late game
-    stages.
+    The function bins the player's actions (see `calc_action_rates`) to
+    measure their APM in each interval of the match, by default in each
+    minute. Based on this it calculates the average values for each game
+    stage, by default the whole, early, mid and late game stages. As in
+    sc2reader's APMTracker plugin, the averages leave out the intervals
+    without actions, and the stages that span the whole match use the
+    player's average APM over the time they played.
 
     *Args*
         - rpl (sc2reader.resources.Replay)
             Replay being analysed
         - pid (int)
             Player id of the player being considered by the function
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the APMs are averaged.
+        - resolution (int = 60)
+            Length of the intervals in the replay's registered seconds.
+        - effective (bool = False)
+            If True, the function averages the effective actions per
+            minute (EPM) instead.
 
     *Returns*
         - dict[str, float]
             Dictionary with the game stage names as key and the Average
-            APMs measurements of each stage as values"""
+            APMs (or EPMs) measurements of each stage as values"""
+    apm_keys = [f'{name}_{"EPM" if effective else "APM"}'
+                for name in stages.names]
     if not rpl.player[pid].is_human:
-        return {'whole_APM':0,'early_APM':0,'mid_APM':0,'late_APM':0,}
-
-    apms_dict = reindex(rpl, rpl.player[pid].apm)
-
-    apms_lists = [[apm for m, apm in apms_dict.items() if m < 4],
-                  [apm for m, apm in apms_dict.items() if 4 <= m < 8],
-                  [apm for m, apm in apms_dict.items() if 8 <= m]]
-
-    dict_keys = ['early_APM', 'mid_APM', 'late_APM']
-
-    avg_apms = {k: average(vals) for k, vals in zip(dict_keys, apms_lists)}
-
-    avg_apms['whole_APM'] = rpl.player[pid].avg_apm
-
-    return avg_apms
-
-
+        return {key: 0 for key in apm_keys}
+
+    rates = bin_actions(rpl, pid, resolution, effective)*(60/resolution)
+    intervals = np.flatnonzero(rates)
+    apms = rates[intervals]
+
+    # Start of each interval in real time, measured in intervals.
+    interval_times = get_timeline(rpl).to_realtime(intervals.astype(float))
+
+    # Each stage averages the intervals that start in the [start, end)
+    # interval. The stages that last until the end of the match also take
+    # its last intervals.
+    starts, ends = stages.limits(rpl.length.seconds)
+    ends[[end is None for _, end in stages.bounds]] = np.inf
+    in_stage = ((interval_times >= starts[:, None]/resolution)
+                & (interval_times < ends[:, None]/resolution))
+
+    # The cumulative sum adds the APMs in order, as the built-in sum does.
+    apm_sums = np.where(in_stage, apms, 0.0).cumsum(axis=1)
+    apm_sums = apm_sums[:, -1] if len(apms) else np.zeros(len(stages))
+
+    whole_match = [bounds == (0, None) for bounds in stages.bounds]
+    average = (calc_average_rate(rpl, pid, effective)
+               if any(whole_match) else None)
+    return {key: (average if whole
+                  else apm_sum/count if count else 0)
+            for key, whole, apm_sum, count
+            in zip(apm_keys, whole_match, apm_sums.tolist(),
+                   in_stage.sum(axis=1).tolist())}
 
 # Internal Cell
-# Herlper fucntion that supports all exportable functions below.
-def build_commands_df(rpl: sc2reader.resources.Replay,
-                events: list[sc2reader.events.game.GameEvent]) -> pd.DataFrame:
-    df_columns =  ['real_time', 'second', 'ability_name']
-
-    commands_df = pd.DataFrame([[calc_realtime_index(com_e.second, rpl),
-                            com_e.second,
-                            com_e.ability_name]
-                        for com_e in events], columns= df_columns)
-
-    return commands_df
+@dataclass(frozen=True)
+class Command_table:
+    """Columns of a player's command events.
+
+    *Attributes*
+        - real_time (np.ndarray)
+            Real time of each command, in seconds.
+        - ability (np.ndarray)
+            Code of each command's ability in `ability_names`.
+        - ability_names (tuple[str, ...])
+            Sorted names of the abilities used in the commands.
+        - special (np.ndarray)
+            Flags the commands that use a special ability of the player's
+            race.
+        - common (np.ndarray)
+            Flags the common commands that do not build anything.
+        - attack (np.ndarray)
+            Flags the common attack commands.
+        - build (np.ndarray)
+            Flags the commands whose ability builds something.
+    """
+    real_time: np.ndarray
+    ability: np.ndarray
+    ability_names: tuple[str, ...]
+    special: np.ndarray
+    common: np.ndarray
+    attack: np.ndarray
+    build: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.real_time)
+
+# Helper function that builds the Command_table of a player, shared by all
+# the exportable functions below.
+@cached_intermediate
+def get_commands_table(rpl: sc2reader.resources.Replay,
+                       pid: int) -> Command_table:
+    commands = get_events(rpl, sc2reader.events.game.CommandEvent, pid)
+
+    # Code each kind of command, i.e. each combination of the ability name
+    # and of the name and build flag of the ability, so the flags are only
+    # computed once per kind.
+    kinds = {}
+    kind_codes = np.fromiter(
+        (kinds.setdefault((com_e.ability_name,
+                           com_e.ability.name if com_e.ability else None,
+                           com_e.ability.is_build if com_e.ability else False),
+                          len(kinds))
+         for com_e in commands),
+        dtype=np.int64, count=len(commands))
+
+    ability_names = tuple(sorted({name for name, _, _ in kinds}))
+    ability_codes = {name: code for code, name in enumerate(ability_names)}
+    special_abilities = get_special_abilities(rpl.player[pid].play_race)
+    common = [not is_build
+              and ability in COMMON_ABILITIES and name in COMMON_ABILITIES
+              for name, ability, is_build in kinds]
+
+    seconds = np.fromiter((com_e.second for com_e in commands),
+                          dtype=int, count=len(commands))
+    kind_column = lambda values, dtype: np.array(values,
+                                                 dtype=dtype)[kind_codes]
+    return Command_table(
+        real_time=get_timeline(rpl).to_realtime(seconds),
+        ability=kind_column([ability_codes[name] for name, _, _ in kinds],
+                            np.int64),
+        ability_names=ability_names,
+        special=kind_column([name in special_abilities
+                             for name, _, _ in kinds], bool),
+        common=kind_column(common, bool),
+        attack=kind_column([is_common and ability == 'Attack'
+                            for is_common, (_, ability, _)
+                            in zip(common, kinds)], bool),
+        build=kind_column([is_build for _, _, is_build in kinds], bool))
 
 # Cell
 
 def calc_spe_abil_ratios(rpl: sc2reader.resources.Replay,
-                         pid: int) -> dict[str, float]:
+                         pid: int,
+                         stages: Game_stages = GAME_STAGES) \
+                         -> dict[str, float]:
     '''
     Extracts a ratio from 0 to 1 that quantifies the use use of special
     abilities.
@@ -137,70 +299,49 @@ def calc_spe_abil_ratios(rpl: sc2reader.resources.Replay,
         - pid (int)
             In-game player ID of the player being considered in the
             analysis.
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the ratios are calculated.
 
     *Returns*
         - dict[float]
             A dictionary containing the special abilities ratio (sar)
-            values for the whole, early, mid and late game.
+            values for each game stage, by default the whole, early, mid
+            and late game.
 
     '''
+    commands = get_commands_table(rpl, pid)
+    masks = stages.masks(commands.real_time, rpl.length.seconds)
 
-    replay_lenght = rpl.length.seconds
-    player_race = rpl.player[pid].play_race
-
-    commands_list = [com_e for com_e in rpl.events
-                if isinstance(com_e, sc2reader.events.game.CommandEvent)
-                and com_e.player.pid == pid]
-
-    abil_comm_list = [com_e for com_e in rpl.events
-                    if isinstance(com_e, sc2reader.events.game.CommandEvent)
-                    and com_e.player.pid == pid
-                    and com_e.ability_name in ABILITIES[player_race]
-                    and com_e.ability_name not in COMMON_ABILITIES]
+    total_commands = masks.sum(axis=1).tolist()
+    total_abilities = (masks & commands.special).sum(axis=1).tolist()
 
-    commands = build_commands_df(rpl, commands_list)
-    abilities_commands = build_commands_df(rpl, abil_comm_list)
+    ratios = [abilities / commands if commands != 0 else 0
+              for abilities, commands in zip(total_abilities, total_commands)]
 
-    commands_dfs = gen_interval_sub_dfs(replay_lenght, commands,
-                                       ['real_time', 'ability_name'])
-    abilities_dfs = gen_interval_sub_dfs(replay_lenght, abilities_commands,
-                                        ['real_time', 'ability_name'])
-
-    ratios = [total_abilities / total_commands if total_commands != 0 else 0
-              for total_abilities, total_commands
-              in zip(map(len, abilities_dfs), map(len, commands_dfs))]
-    ratios_names = ['whole_sar', 'early_sar', 'mid_sar', 'late_sar']
-
-    return {nam: rat for nam, rat in zip(ratios_names, ratios)}
+    return {f'{nam}_sar': rat for nam, rat in zip(stages.names, ratios)}
 
 # Internal Cell
 
-def get_top_abilities(abilities: pd.DataFrame) -> dict[str, tuple[str,str]]:
-    prefered = None
-    second = None
-    if not abilities.empty:
-        ability_count = (abilities
-                        .groupby('ability_name')
-                        .size())
-
-        ability_count.sort_values(ascending=False, inplace=True)
-
-        if len(ability_count) > 0:
-            prefered = ability_count.index[0]
-
-        if len(ability_count) >= 2:
-            second = ability_count.index[1]
-
-    return (prefered, second)
-
+# Helper function that lists the two abilities with the highest counts. The
+# ties keep the order of pandas.Series.sort_values(ascending=False), which
+# reverses the counts before sorting them.
+def get_top_abilities(ability_count: np.ndarray,
+                      ability_names: Sequence[str]) -> tuple[str, str]:
+    used = np.flatnonzero(ability_count)[::-1]
+    ranking = used[ability_count[used].argsort(kind='quicksort')][::-1]
 
+    top_abilities = [ability_names[idx] for idx in ranking[:2]]
+    return tuple(top_abilities + [None]*(2 - len(top_abilities)))
 
 # Cell
 def get_prefered_spec_abil(rpl: sc2reader.resources.Replay,
-                           pid: int) -> dict[str, tuple[str, int]]:
+                           pid: int,
+                           stages: Game_stages = GAME_STAGES) \
+                           -> dict[str, tuple[str, int]]:
 
     '''Extracts the names of the two special abilities a player uses the
-    most during the whole, early, mid and late games.
+    most during each game stage, by default the whole, early, mid and late
+    games.
 
     *Args*
         - rpl (sc2reader.resources.Replay)
@@ -208,6 +349,8 @@ def get_prefered_spec_abil(rpl: sc2reader.resources.Replay,
         - pid (int)
             In-game player ID of the player being considered in the
             analysis.
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the preferences are extracted.
 
     *Returns*
         - dict[str, tuple[str, int]]
@@ -216,30 +359,30 @@ def get_prefered_spec_abil(rpl: sc2reader.resources.Replay,
             the first and second abilities the player uses the most in
             that order.
     '''
-    replay_lenght = rpl.length.seconds
-    player_race = rpl.player[pid].play_race
-
-
-    abil_comm_list = [com_e for com_e in rpl.events
-                    if isinstance(com_e, sc2reader.events.game.CommandEvent)
-                    and com_e.player.pid == pid
-                    and com_e.ability_name in ABILITIES[player_race]
-                    and com_e.ability_name not in COMMON_ABILITIES]
-
-    abilities_commands = build_commands_df(rpl, abil_comm_list)
-
-    abilities_dfs = gen_interval_sub_dfs(replay_lenght, abilities_commands,
-                                        ['real_time', 'ability_name'])
-
-    stage_names = ['whole_pref_sab', 'early_pref_sab',
-                   'mid_pref_sab', 'late_pref_sab']
-    preferences = [get_top_abilities(df) for df in abilities_dfs]
-
-    return {nam: pref for nam, pref in zip(stage_names, preferences)}
+    commands = get_commands_table(rpl, pid)
+    masks = (stages.masks(commands.real_time, rpl.length.seconds)
+             & commands.special)
+
+    # Count the uses of each ability in every stage at once. The names are
+    # sorted, as groupby would sort them.
+    ability_names = commands.ability_names
+    stage_idx, command_idx = np.nonzero(masks)
+    ability_counts = np.bincount(
+                        stage_idx*len(ability_names)
+                        + commands.ability[command_idx],
+                        minlength=len(stages)*len(ability_names))
+    ability_counts = ability_counts.reshape(len(stages), len(ability_names))
+
+    preferences = [get_top_abilities(counts, ability_names)
+                   for counts in ability_counts]
+
+    return {f'{nam}_pref_sab': pref
+            for nam, pref in zip(stages.names, preferences)}
 
 # Cell
 def calc_attack_ratio(rpl: sc2reader.resources.Replay,
-                      pid: int) -> dict[str, float]:
+                      pid: int,
+                      stages: Game_stages = GAME_STAGES) -> dict[str, float]:
     '''Calculates the ratio between a player's attack orders and their
     common commands.
 
@@ -253,38 +396,22 @@ def calc_attack_ratio(rpl: sc2reader.resources.Replay,
         - pid (int)
             In-game player ID of the player being considered in the
             analysis.
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the ratios are calculated.
 
     *Returns*
         - dict[str, float]
             A dictionary that separates a player's attack ratios for the
             different stages of a match.
     '''
-    replay_lenght = rpl.length.seconds
-
-    common_comms = [com_e for com_e in rpl.events
-                if isinstance(com_e, sc2reader.events.game.CommandEvent)
-                and com_e.player.pid == pid
-                and not com_e.ability.is_build
-                and com_e.ability.name in COMMON_ABILITIES
-                and com_e.ability_name in COMMON_ABILITIES]
-
-    attack_comms = [att for att in common_comms
-                if att.ability.name == 'Attack']
-
-    common_comms_dfs = build_commands_df(rpl, common_comms)
-    attack_comms_dfs = build_commands_df(rpl, attack_comms)
-
-    cc_subdf_list = gen_interval_sub_dfs(replay_lenght, common_comms_dfs,
-                                        ['real_time', 'ability_name'])
-
-    ca_subdf_list = gen_interval_sub_dfs(replay_lenght, attack_comms_dfs,
-                                        ['real_time', 'ability_name'])
+    commands = get_commands_table(rpl, pid)
+    masks = stages.masks(commands.real_time, rpl.length.seconds)
 
+    common_counts = (masks & commands.common).sum(axis=1).tolist()
+    attack_counts = (masks & commands.attack).sum(axis=1).tolist()
 
-    ratios_names = ['whole_att_ratio', 'early_att_ratio',
-                   'mid_att_ratio', 'late_att_ratio']
-    att_ratios = [round(len(att) / len(comm), ndigits=3)
-                  if len(comm) != 0 else 0
-                  for att, comm in zip(ca_subdf_list, cc_subdf_list)]
+    att_ratios = [round(att / comm, ndigits=3) if comm != 0 else 0
+                  for att, comm in zip(attack_counts, common_counts)]
 
-    return {nam: rat for nam, rat in zip(ratios_names, att_ratios)}
\ No newline at end of file
+    return {f'{nam}_att_ratio': rat
+            for nam, rat in zip(stages.names, att_ratios)}
\ No newline at end of file
@@ -1,6 +1,7 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 02_handle_tracker_events.ipynb (unless otherwise specified).
 
-__all__ = ['INTERVALS_BASE', 'calc_realtime_index']
+__all__ = ['INTERVALS_BASE', 'Game_stages', 'GAME_STAGES', 'index_events', 'get_events', 'Replay_timeline',
+           'get_timeline', 'calc_realtime_index', 'cached_intermediate', 'Data_table', 'register_plugin']
 
 # Internal Cell
 
@@ -8,15 +9,274 @@ __all__ = ['INTERVALS_BASE', 'calc_realtime_index']
 
 from pathlib import Path
 from pprint import pprint
+from dataclasses import dataclass
 from typing import *
 
-import fastcore.test as ft
+import inspect
+import functools
+import csv
+import json
+import numpy as np
 
 import sc2reader
 
 # Cell
 INTERVALS_BASE = 4*60
 
+# Cell
+@dataclass(frozen=True)
+class Game_stages:
+    """Stages of a match in which the performance indicators are computed.
+
+    Each stage is a (start, end) interval in real time seconds, where an
+    end of None stands for the end of the match. If relative is True, the
+    bounds are fractions of the match's length instead.
+
+    *Attributes*
+        - names (tuple[str, ...])
+            Names of the stages, which prefix the indicators' keys.
+        - bounds (tuple[tuple[float, Optional[float]], ...])
+            Start and end of each stage.
+        - relative (bool = False)
+            True if the bounds are fractions of the match's length.
+
+    *Errors*
+        - ValueError
+            If the names and the bounds do not match, the names are
+            repeated, or a stage does not start before it ends.
+    """
+    names: tuple[str, ...]
+    bounds: tuple[tuple[float, Optional[float]], ...]
+    relative: bool = False
+
+    def __post_init__(self):
+        object.__setattr__(self, 'names', tuple(self.names))
+        object.__setattr__(self, 'bounds',
+                           tuple((start, end) for start, end in self.bounds))
+        if not self.names or len(self.names) != len(self.bounds):
+            raise ValueError('Each stage needs a name and (start, end) bounds')
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(f'Repeated stage names: {self.names}')
+        for name, (start, end) in zip(self.names, self.bounds):
+            if start < 0 or (end is not None and end <= start):
+                raise ValueError(f'Stage {name} has invalid bounds '
+                                 f'{(start, end)}')
+
+    @classmethod
+    def from_boundaries(cls, boundaries: Sequence[float],
+                        names: Optional[Sequence[str]] = None,
+                        whole: bool = True,
+                        relative: bool = False) -> 'Game_stages':
+        """Splits the matches into consecutive stages at the given
+        boundaries. The last stage lasts until the end of the match.
+
+        *Args*
+            - boundaries (Sequence[float])
+                Increasing times at which a stage ends and the next starts.
+            - names (Sequence[str], optional)
+                Names of the consecutive stages. Defaults to stage_1,
+                stage_2, etc.
+            - whole (bool = True)
+                If True, a first stage named whole covers the entire match.
+            - relative (bool = False)
+                True if the boundaries are fractions of the match's length.
+        """
+        marks = [0, *boundaries, None]
+        bounds = [(start, end) for start, end in zip(marks, marks[1:])]
+        if names is None:
+            names = [f'stage_{num}' for num in range(1, len(bounds) + 1)]
+        if whole:
+            names, bounds = ['whole', *names], [(0, None), *bounds]
+        return cls(names, bounds, relative)
+
+    @classmethod
+    def equal_windows(cls, n: int, whole: bool = True) -> 'Game_stages':
+        """Splits each match into n windows of the same length, named
+        window_1, window_2, etc."""
+        if n < 1:
+            raise ValueError(f'n must be greater than 0, not {n}')
+        names = [f'window_{num}' for num in range(1, n + 1)]
+        return cls.from_boundaries([num/n for num in range(1, n)], names,
+                                   whole, relative=True)
+
+    @classmethod
+    def rolling(cls, width: float, step: float, until: float,
+                whole: bool = True) -> 'Game_stages':
+        """Defines windows of width seconds that start every step seconds
+        from the start of the match until a given second. The windows are
+        named window_1, window_2, etc."""
+        if width <= 0 or step <= 0 or until <= 0:
+            raise ValueError('width, step and until must be greater than 0')
+        starts = np.arange(0, until, step).tolist()
+        names = [f'window_{num}' for num in range(1, len(starts) + 1)]
+        bounds = [(start, start + width) for start in starts]
+        if whole:
+            names, bounds = ['whole', *names], [(0, None), *bounds]
+        return cls(names, bounds)
+
+    def limits(self, rpl_length: float) -> tuple[np.ndarray, np.ndarray]:
+        """Arrays of the starts and ends of the stages of a match, in
+        seconds. An end of None becomes the match's length."""
+        scale, length = (rpl_length, 1) if self.relative else (1, rpl_length)
+        starts = np.array([start for start, _ in self.bounds], dtype=float)
+        ends = np.array([length if end is None else end
+                         for _, end in self.bounds], dtype=float)
+        return starts*scale, ends*scale
+
+    def intervals(self, rpl_length: float) \
+                  -> list[Optional[tuple[float, float]]]:
+        """Lists the (start, end) intervals of the stages of a match, with
+        their ends trimmed to the match's length. The stages that the
+        match does not reach are None."""
+        if rpl_length <= 0:
+            raise ValueError(f'rpl_length must be greater than 0, '
+                             f'not {rpl_length}')
+        starts, ends = self.limits(rpl_length)
+        return [(start, min(end, rpl_length)) if start < rpl_length else None
+                for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def masks(self, times: np.ndarray, rpl_length: float) -> np.ndarray:
+        """Flags the records of each stage based on their real time. As
+        with pandas.Series.between, the bounds of the intervals are
+        included.
+
+        *Returns*
+            - np.ndarray
+                Boolean array with a row per stage and a column per record.
+                The rows of the stages the match does not reach are False.
+        """
+        if rpl_length <= 0:
+            raise ValueError(f'rpl_length must be greater than 0, '
+                             f'not {rpl_length}')
+        starts, ends = self.limits(rpl_length)
+        reached = starts < rpl_length
+        ends = np.minimum(ends, rpl_length)[:, None]
+        times = np.asarray(times, dtype=float)[None, :]
+        return (times >= starts[:, None]) & (times <= ends) & reached[:, None]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+# Cell
+GAME_STAGES = Game_stages.from_boundaries([INTERVALS_BASE, INTERVALS_BASE*2],
+                                          ['early', 'mid', 'late'])
+
+# Cell
+
+def index_events(rpl: sc2reader.resources.Replay) \
+                -> dict[tuple[type, Optional[int]], list]:
+    """Builds, in a single pass, an index of a replay's events organised
+    by event class and player.
+
+    The index is stored in the replay's `event_index` attribute, so it is
+    only built once per replay.
+
+    *Args*
+        - rpl (sc2reader.resources.Replay)
+            Working replay
+
+    *Returns*
+        - dict[tuple[type, Optional[int]], list]
+            Dictionary that uses the (event class, player id) tuples as
+            keys and the list of the matching events as values. The
+            (event class, None) keys list the events of all players.
+    """
+    if hasattr(rpl, 'event_index'):
+        return rpl.event_index
+
+    event_index = dict()
+    for event in rpl.events:
+        if isinstance(event, sc2reader.events.game.GameEvent):
+            player = getattr(event, 'player', None)
+            pid = player.pid if player else None
+        else:
+            pid = getattr(event, 'pid', None)
+
+        for event_class in type(event).__mro__[:-1]:
+            event_index.setdefault((event_class, None), []).append(event)
+            if pid is not None:
+                event_index.setdefault((event_class, pid), []).append(event)
+
+    rpl.event_index = event_index
+    return event_index
+
+def get_events(rpl: sc2reader.resources.Replay,
+               event_class: type,
+               pid: Optional[int] = None) -> list:
+    """Lists the events of a particular class from a replay.
+
+    *Args*
+        - rpl (sc2reader.resources.Replay)
+            Working replay
+        - event_class (type)
+            Class of the events that should be listed. Events of its
+            subclasses are also included.
+        - pid (Optional[int] = None)
+            Id of the player whose events should be listed. If None, the
+            function lists the events of all the players.
+
+    *Returns*
+        - list
+            Events of the requested class, in the order they appear in the
+            replay.
+    """
+    return list(index_events(rpl).get((event_class, pid), []))
+
+# Cell
+@dataclass(frozen=True)
+class Replay_timeline:
+    """
+    Immutable dataclass that stores the information needed to convert the
+    times registered in a replay's events into real time indexes that
+    match the replay's duration.
+
+    *Attributes:*
+        - rpl_length (int):
+            Length of the match in seconds.
+        - last_rec_time (int):
+            Last second registered by the replay's PlayerStatsEvents.
+        - game_fps (float):
+            Frames per second of the replay.
+    """
+    rpl_length: int
+    last_rec_time: int
+    game_fps: float
+
+    def to_realtime(self, registered_time: Union[float, np.ndarray]) \
+                    -> Union[float, np.ndarray]:
+        """Converts a registered time in seconds, or an array of them,
+        into real time indexes."""
+        return (registered_time/self.last_rec_time) * self.rpl_length
+
+    def frames_to_realtime(self, frames: Union[float, np.ndarray]) \
+                           -> Union[float, np.ndarray]:
+        """Converts a frame number, or an array of them, into real time
+        indexes."""
+        return self.to_realtime(frames/self.game_fps)
+
+
+def get_timeline(rpl: sc2reader.resources.Replay) -> Replay_timeline:
+    """Gets the `Replay_timeline` of a replay.
+
+    The timeline is built the first time the function is called on a
+    replay and stored in the replay's `timeline` attribute.
+
+    *Args*
+        - rpl (sc2reader.resources.Replay)
+            Working replay
+
+    *Returns*
+        - Replay_timeline
+            The replay's timeline.
+    """
+    if not hasattr(rpl, 'timeline'):
+        last_pstatse = get_events(rpl,
+                                  sc2reader.events.tracker.PlayerStatsEvent)[-1]
+        rpl.timeline = Replay_timeline(rpl.length.seconds,
+                                       last_pstatse.second,
+                                       rpl.game_fps)
+    return rpl.timeline
+
 # Cell
 
 def calc_realtime_index(registered_time: int,
@@ -28,6 +288,9 @@ def calc_realtime_index(registered_time: int,
     coincide with the replay duration, this function recalculates the time
     index of an event to correct this discrepancy.
 
+    This function is a wrapper for the `to_realtime` method of the
+    replay's `Replay_timeline` (see `get_timeline`).
+
     *Args*
         - registered_time (int)
             The time index in seconds recorded in the event. Normally
@@ -39,9 +302,115 @@ def calc_realtime_index(registered_time: int,
         - float
             The time index that would match the replay's duration
     """
-    rpl_length = rpl.length.seconds
-    rpl_last_rec_time = [e.second for e in rpl.events
-                        if isinstance(e,
-                        sc2reader.events.tracker.PlayerStatsEvent)][-1]
+    return get_timeline(rpl).to_realtime(registered_time)
+
+# Cell
+def cached_intermediate(func: Callable) -> Callable:
+    """Decorator for the helper functions that build intermediate tables
+    from a replay.
+
+    The decorated function builds its table once per replay and
+    combination of arguments, and stores it in the replay's
+    `intermediates` attribute. The following calls with the same
+    arguments return the stored table.
+
+    *Args*
+        - func (Callable)
+            Function that receives the replay as its first argument.
+
+    *Returns*
+        - Callable
+            The memoised function.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(rpl, *args, **kwargs):
+        # Bind the arguments, so positional and keyword calls share a key.
+        bound = signature.bind(rpl, *args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__, *list(bound.arguments.values())[1:])
+
+        if not hasattr(rpl, 'intermediates'):
+            rpl.intermediates = dict()
+        if key not in rpl.intermediates:
+            rpl.intermediates[key] = func(rpl, *args, **kwargs)
+        return rpl.intermediates[key]
+
+    return wrapper
+
+# Internal Cell
+# Folder that stores the project's data files.
+if __name__ == "__main__":
+    data_path = Path(Path.cwd()/'data')
+else:
+    data_path = Path(__file__).resolve().parents[2]/'data'
+
+# Cell
+class Data_table:
+    """Table stored in one of the project's data files, which is only read
+    from disk the first time it is used.
+
+    The object behaves like the list or dictionary that the file stores,
+    so it can be indexed, iterated and searched in the same way.
+
+    *Args*
+        - file_name (str)
+            Name of a JSON file, or of a CSV file that stores a single row
+            of names.
+        - folder (Union[str, Path], optional)
+            Folder that contains the file. Defaults to the project's data
+            folder.
+    """
+    def __init__(self, file_name: str,
+                 folder: Optional[Union[str, Path]] = None):
+        self.path = (data_path if folder is None else Path(folder))/file_name
+        self._data = None
+
+    @property
+    def data(self) -> Union[list, dict]:
+        """The content of the file, which is read on first access."""
+        if self._data is None:
+            with open(self.path) as f:
+                if self.path.suffix == '.csv':
+                    self._data = next(csv.reader(f))
+                else:
+                    self._data = json.load(f)
+        return self._data
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.data[key]
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.data
+
+    def __iter__(self) -> Iterator:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f'Data_table({self.path.name!r})'
+
+# Cell
+def register_plugin(plugin: Any) -> bool:
+    """Registers a plugin in sc2reader's engine, unless a plugin with the
+    same name is already registered.
+
+    *Args*
+        - plugin (Any)
+            Instance of the sc2reader plugin.
+
+    *Returns*
+        - bool
+            True if the plugin was registered, False if the engine
+            already had it.
+    """
+    name = getattr(plugin, 'name', type(plugin).__name__)
+    for registered in sc2reader.engine.plugins():
+        if getattr(registered, 'name', type(registered).__name__) == name:
+            return False
 
-    return (registered_time/rpl_last_rec_time) * rpl_length
\ No newline at end of file
+    sc2reader.engine.register_plugin(plugin)
+    return True
\ No newline at end of file
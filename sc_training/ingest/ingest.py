@@ -1,6 +1,8 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 07_ingest.ipynb (unless otherwise specified).
 
-__all__ = ['Config_settings', 'load_configurations', 'set_up_db', 'inventory_replays']
+__all__ = ['Config_settings', 'load_configurations', 'ensure_indexes', 'DB_INDEXES', 'set_up_db', 'index_usage_stats',
+           'Indicator', 'INTERMEDIATES', 'INDICATORS', 'Ingest_timings', 'load_economy', 'Bulk_writer', 'Bloom_filter',
+           'inventory_replays', 'Replay_manifest', 'watch_replays', 'Cached_replay', 'Event_cache', 'rescore_replays']
 
 # Internal Cell
 
@@ -9,8 +11,12 @@ import pymongo
 import json
 import sc2reader
 import errno
-import jsonschema
 import os
+import time
+import math
+import hashlib
+import multiprocessing
+import zlib
 
 import pandas as pd
 import numpy as np
@@ -18,14 +24,22 @@ import numpy as np
 from typing import *
 from pathlib import Path
 from pprint import pprint
-from jsonschema import validate
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from functools import partial
+from contextlib import contextmanager
 from dataclasses import dataclass, astuple, asdict, field
 
-from sc2reader.engine.plugins import APMTracker
-
-from . import *
-sc2reader.engine.register_plugin(APMTracker())
-sc2reader.engine.register_plugin(CtrlGroupTracker())
+from .summarise_rpl import *
+from .handle_tracker_event import *
+from .macro_econ_parser import *
+from .build_parser import *
+from .handle_command_events import *
+from .selection_parser import *
+from .macro_econ_parser import get_player_macro_econ_df
+from .build_parser import composition_df
+from .handle_command_events import get_commands_table
+from .selection_parser import get_selection_table
 
 # Internal Cell
 
@@ -48,8 +62,12 @@ def validate_config_file(file: Path, schema: Dict[str, Any]) -> bool:
     """This helper function uses the json schema defined above to
     make sure that the config file includes all the information
     necessary for the solution's proper work"""
+    # jsonschema is slow to import, so it is only loaded when a config
+    # file is validated.
+    import jsonschema
+
     try:
-        validate(file, schema)
+        jsonschema.validate(file, schema)
     except jsonschema.exceptions.ValidationError as err:
         print(err)
         print("config.json does not conform to the required specifications")
@@ -167,9 +185,57 @@ def flatten_indicators(nested_value: dict) -> dict[str, float]:
 
 
 # Cell
-def set_up_db() -> pymongo.database.Database:
+DB_INDEXES = {
+    'replays': [
+        ([('replay_name', pymongo.ASCENDING)], {'unique': True}),
+        ([('players.0.username', pymongo.ASCENDING),
+          ('players.0.race', pymongo.ASCENDING)], {}),
+        ([('players.1.username', pymongo.ASCENDING),
+          ('players.1.race', pymongo.ASCENDING)], {})],
+    'indicators': [
+        ([('replay_name', pymongo.ASCENDING),
+          ('player_id', pymongo.ASCENDING)], {'unique': True})],
+    'economy': [
+        ([('replay_name', pymongo.ASCENDING),
+          ('player_id', pymongo.ASCENDING)], {'unique': True}),
+        ([('player_username', pymongo.ASCENDING)], {})]}
+
+
+def ensure_indexes(working_db: pymongo.database.Database) -> list[str]:
+    """Creates the indexes declared in `DB_INDEXES` that do not exist in
+    a database.
+
+    *Args*
+        - working_db (pymongo.database.Database)
+            Database where the indexes are created.
+
+    *Returns*
+        - list[str]
+            Names of the indexes declared in `DB_INDEXES`, in the
+            '<collection>.<index>' format.
+
+    *Errors*
+        - pymongo.errors.OperationFailure
+            If a unique index cannot be created because the collection
+            already contains duplicated documents.
+    """
+    index_names = []
+    for collection, indexes in DB_INDEXES.items():
+        for keys, options in indexes:
+            name = working_db[collection].create_index(keys, **options)
+            index_names.append(f'{collection}.{name}')
+
+    return index_names
+
+# Cell
+def set_up_db(ensure: bool = True) -> pymongo.database.Database:
     """Loads the database specified in the project's config.json file.
 
+    *Args*
+        - ensure (bool = True)
+            If True, the indexes declared in `DB_INDEXES` are created in
+            the database if they do not exist.
+
     *Returns*
         - pymongo.database.Database
             Python object that allows the user to interact with the
@@ -179,9 +245,42 @@ def set_up_db() -> pymongo.database.Database:
     mongo_client = pymongo.MongoClient(db_settings.port_address,
                                     db_settings.port_number)
     worcking_bd = mongo_client[db_settings.db_name]
+    if ensure:
+        ensure_indexes(worcking_bd)
 
     return worcking_bd
 
+# Cell
+def index_usage_stats(working_db: pymongo.database.Database,
+                      collections: Iterable[str] = ('replays', 'indicators'))\
+                      -> pd.DataFrame:
+    """Reports how many times each index of a set of collections has been
+    used since the server started or the index was created.
+
+    *Args*
+        - working_db (pymongo.database.Database)
+            Database that contains the collections.
+        - collections (Iterable[str] = ('replays', 'indicators'))
+            Names of the collections to report.
+
+    *Returns*
+        - pandas.DataFrame
+            One row per index, with its collection, name, key, the number
+            of operations that used it ('ops') and the start of the count
+            ('since').
+    """
+    rows = []
+    for collection in collections:
+        for stats in working_db[collection].aggregate([{'$indexStats': {}}]):
+            rows.append({'collection': collection,
+                         'index': stats['name'],
+                         'key': dict(stats['key']),
+                         'ops': stats['accesses']['ops'],
+                         'since': stats['accesses']['since']})
+
+    return pd.DataFrame(rows, columns=['collection', 'index', 'key', 'ops',
+                                       'since'])
+
 # Internal Cell
 # Helper function that verifies the path of the where the replays should
 # be located according to the config file.
@@ -200,52 +299,778 @@ def verify_replays_path(rpl_path: Any) -> Path:
 
     return path
 
+# Cell
+@dataclass(frozen=True)
+class Indicator:
+    """Entry of the `INDICATORS` registry.
+
+    *Attributes:*
+        - name (str):
+            Name used to request the indicator in `extract_indicators`.
+        - func (Callable):
+            Function that receives the replay and the player's id and
+            returns a dictionary of indicators.
+        - tables (tuple[str, ...]):
+            Names of the `INTERMEDIATES` tables that the function uses.
+        - kwargs (dict[str, Any]):
+            Extra keyword arguments passed to the function.
+        - flatten (bool):
+            True if the function's result has to be flattened with
+            `flatten_indicators`.
+        - staged (bool):
+            True if the function computes its indicators for each game
+            stage, and receives the `Game_stages` in its stages argument.
+    """
+    name: str
+    func: Callable[..., dict]
+    tables: tuple[str, ...] = ()
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    flatten: bool = False
+    staged: bool = False
+
+
+INTERMEDIATES = {
+    'macro_econ_df': get_player_macro_econ_df,
+    'army_units_df': partial(composition_df, buildings=False),
+    'buildings_units_df': partial(composition_df, buildings=True),
+    'army_lifetimes': partial(unit_lifetimes, buildings=False),
+    'buildings_lifetimes': partial(unit_lifetimes, buildings=True),
+    'commands_table': get_commands_table,
+    'selection_table': get_selection_table}
+
+INDICATORS = {indicator.name: indicator for indicator in [
+    Indicator('macro_econ_stats', get_player_macro_econ_stats,
+              ('macro_econ_df',), staged=True),
+    Indicator('expan_times', get_expan_times, ('buildings_units_df',)),
+    Indicator('expan_counts', get_expan_counts, ('buildings_units_df',),
+              staged=True),
+    Indicator('attack_ratio', calc_attack_ratio, ('commands_table',),
+              staged=True),
+    Indicator('ctrlg_ratio', calc_ctrlg_ratio, ('selection_table',),
+              staged=True),
+    Indicator('max_active_groups', count_max_active_groups,
+              ('selection_table',), staged=True),
+    Indicator('get_ctrl_grp_ratio', calc_get_ctrl_grp_ratio,
+              ('selection_table',), staged=True),
+    Indicator('select_ratio', calc_select_ratio, ('selection_table',),
+              staged=True),
+    Indicator('upgrades', list_player_upgrades),
+    Indicator('spe_abil_ratios', calc_spe_abil_ratios, ('commands_table',),
+              staged=True),
+    Indicator('apms', calc_apms, staged=True),
+    Indicator('prefered_spec_abil', get_prefered_spec_abil,
+              ('commands_table',), flatten=True, staged=True),
+    Indicator('buildings_composition', count_composition,
+              ('buildings_units_df', 'buildings_lifetimes'),
+              {'buildings': True}, True, True),
+    Indicator('army_composition', count_composition,
+              ('army_units_df', 'army_lifetimes'),
+              {'buildings': False}, True, True),
+    Indicator('buildings_started', count_started,
+              ('buildings_units_df', 'buildings_lifetimes'),
+              {'buildings': True}, True, True),
+    Indicator('army_started', count_started,
+              ('army_units_df', 'army_lifetimes'),
+              {'buildings': False}, True, True)]}
+
+# Cell
+@dataclass
+class Ingest_timings:
+    """Wall time and number of calls of the steps of the ingest process.
+
+    *Attributes*
+        - calls (dict[str, int])
+            Number of times each step ran.
+        - seconds (dict[str, float])
+            Total seconds spent in each step.
+    """
+    calls: dict[str, int] = field(default_factory=dict)
+    seconds: dict[str, float] = field(default_factory=dict)
+
+    @contextmanager
+    def measure(self, step: str) -> Iterator[None]:
+        """Context manager that adds the time spent in its block to a
+        step."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(step, time.perf_counter() - start)
+
+    def add(self, step: str, seconds: float, calls: int = 1) -> None:
+        """Adds the calls and the time of a step."""
+        self.calls[step] = self.calls.get(step, 0) + calls
+        self.seconds[step] = self.seconds.get(step, 0) + seconds
+
+    def merge(self, other: 'Ingest_timings') -> None:
+        """Adds the timings of another object to this one."""
+        for step, seconds in other.seconds.items():
+            self.add(step, seconds, other.calls[step])
+
+    @property
+    def total(self) -> float:
+        """Total seconds spent in all the steps."""
+        return sum(self.seconds.values())
+
+    def __str__(self):
+        lines = [f'{"Step":<24} {"Calls":>7} {"Total (s)":>10} '
+                 f'{"Mean (ms)":>10} {"Share":>7}']
+        for step, seconds in sorted(self.seconds.items(),
+                                    key=lambda item: -item[1]):
+            calls = self.calls[step]
+            lines.append(f'{step:<24} {calls:>7} {seconds:>10.3f} '
+                         f'{1000*seconds/calls:>10.2f} '
+                         f'{seconds/self.total:>7.1%}')
+        return '\n'.join(lines)
+
 # Internal Cell
-# Helper function that extracts the indicators for each matc's players and
+# Helper function that lists the registered indicators selected by name,
+# keeping the order of the registry.
+def select_indicators(names: Optional[Iterable[str]] = None) \
+                      -> list[Indicator]:
+    if names is None:
+        return list(INDICATORS.values())
+
+    names = set(names)
+    unknown = names - INDICATORS.keys()
+    if unknown:
+        raise ValueError(f'Unknown indicators: {sorted(unknown)}')
+
+    return [indicator for indicator in INDICATORS.values()
+            if indicator.name in names]
+
+
+# Helper function that extracts the indicators for each match's players as
+# a list of flat dictionaries.
+def extract_indicators(rpl: sc2reader.resources.Replay,
+                       indicators: Optional[Iterable[str]] = None,
+                       timings: Optional[Ingest_timings] = None,
+                       stages: Optional[Game_stages] = None) \
+                       -> list[dict[str, Any]]:
+    """Runs through the indicator extraction loop and returns one flat
+    dictionary of indicators per player in the replay.
+
+    The values in the dictionaries are plain python types, so they can be
+    sent between processes or stored directly in the database.
+
+    *Args*
+        - rpl (sc2reader.resources.Replay)
+            Working replay.
+        - indicators (Iterable[str], optional)
+            Names of the `INDICATORS` to compute. By default, the function
+            computes all of them.
+        - timings (Ingest_timings, optional)
+            Object where the time spent indexing the events, building each
+            table and computing each indicator is recorded.
+        - stages (Game_stages, optional)
+            Game stages in which the staged indicators are computed. By
+            default, the functions use `GAME_STAGES`.
+
+    *Errors*
+        - ValueError
+            If one of the indicators is not in the registry.
+    """
+    selected = select_indicators(indicators)
+    tables = list(dict.fromkeys(table for indicator in selected
+                                for table in indicator.tables))
+    if timings is None:
+        timings = Ingest_timings()
+
+    with timings.measure('index_events'):
+        index_events(rpl)
+
+    players_indicators = []
+    for pid, player in rpl.player.items():
+        rpl_indicators = {'replay_name': rpl.filename,
+                          'player_username': player.name,
+                          'player_id': pid}
+
+        # Build the shared tables first, so each one is built only once.
+        for table in tables:
+            with timings.measure(table):
+                INTERMEDIATES[table](rpl, pid)
+
+        for indicator in selected:
+            kwargs = (indicator.kwargs
+                      if stages is None or not indicator.staged
+                      else {**indicator.kwargs, 'stages': stages})
+            with timings.measure(indicator.name):
+                values = indicator.func(rpl, pid, **kwargs)
+            rpl_indicators.update(flatten_indicators(values)
+                                  if indicator.flatten else values)
+
+        rpl_ind = ({k: v
+                    if not isinstance(v, (np.integer, np.floating))
+                    else float(v) for k, v in rpl_indicators.items()})
+
+        players_indicators.append(rpl_ind)
+
+    return players_indicators
+
+# Helper function that extracts the indicators for each match's players and
 # stores it in the indicators collection.
 def build_indicators(rpl: sc2reader.resources.Replay,
-                    working_db: pymongo.database.Database) -> None:
+                    working_db: pymongo.database.Database,
+                    stages: Optional[Game_stages] = None) -> None:
 
     """Runs through the indicator extraction loop and stores the results
-    in the indicators collections.
+    in the indicators collections. The indicators are computed for the
+    given game stages (see `extract_indicators`).
     """
-    simple_functions = [get_player_macro_econ_stats,
-                        get_expan_times,
-                        get_expan_counts,
-                        calc_attack_ratio,
-                        calc_ctrlg_ratio,
-                        count_max_active_groups,
-                        calc_get_ctrl_grp_ratio,
-                        calc_select_ratio,
-                        list_player_upgrades,
-                        calc_spe_abil_ratios,
-                        calc_apms
-                        ]
-
-    double_functions = [count_composition,
-                        count_started]
     indi_collect = working_db['indicators']
-    for pid in rpl.player.keys():
-        rpl_indicators = {}
-        for func in simple_functions:
-            rpl_indicators.update(func(rpl, pid))
+    for rpl_ind in extract_indicators(rpl, stages=stages):
+        indi_collect.insert_one(rpl_ind)
 
-        v = get_prefered_spec_abil(rpl, pid)
-        rpl_indicators.update(flatten_indicators(v))
+# Internal Cell
+# Helper functions that store the columns of a time series as compressed
+# bytes and restore them. The integer columns are stored as the
+# differences between consecutive values.
+def encode_column(values: np.ndarray) -> dict[str, Any]:
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        values = np.diff(values, prepend=values.dtype.type(0))
+    return {'dtype': values.dtype.str,
+            'data': zlib.compress(values.tobytes())}
 
-        for func in double_functions:
-            for flag in [True, False]:
-                rpl_indicators.update(flatten_indicators(func(rpl, pid, flag)))
 
-        rpl_ind = ({k: v
-                    if (not (isinstance(v, np.int64)
-                        or isinstance(v, np.float64)))
-                    else float(v) for k, v in rpl_indicators.items()})
+def decode_column(column: dict[str, Any]) -> np.ndarray:
+    values = np.frombuffer(zlib.decompress(column['data']),
+                           dtype=column['dtype'])
+    if values.dtype.kind in 'iu':
+        return values.cumsum(dtype=values.dtype)
+    return values.copy()
 
-        indi_collect.insert_one(rpl_ind)
+
+# Helper function that builds the economy documents of a replay's players.
+def extract_economy(rpl: sc2reader.resources.Replay) -> list[dict[str, Any]]:
+    """Lists a document with the economy time series of each player in a
+    replay (see `get_player_macro_econ_df`), ready to be stored in the
+    economy collection."""
+    economy_docs = []
+    for pid, player in rpl.player.items():
+        econ_df = get_player_macro_econ_df(rpl, pid)
+        economy_docs.append({
+            'replay_name': rpl.filename,
+            'player_id': pid,
+            'player_username': player.name,
+            'records': len(econ_df),
+            'columns': {column: encode_column(econ_df[column].to_numpy())
+                        for column in econ_df.columns}})
+    return economy_docs
+
+# Cell
+def load_economy(working_db: pymongo.database.Database,
+                 replay_names: Optional[Iterable[str]] = None,
+                 player_names: Optional[Iterable[str]] = None,
+                 columns: Optional[Sequence[str]] = None) \
+                 -> dict[tuple[str, int], dict[str, np.ndarray]]:
+    """Reads the economy time series stored by the ingest functions.
+
+    *Args*
+        - working_db (pymongo.database.Database)
+            Database that stores the economy collection.
+        - replay_names (Iterable[str], optional)
+            Names of the replays whose series are read. By default, the
+            series of all the replays are read.
+        - player_names (Iterable[str], optional)
+            Usernames of the players whose series are read. By default,
+            the series of all the players are read.
+        - columns (Sequence[str], optional)
+            Columns of the series that are read (see
+            `get_player_macro_econ_df`). By default, all of them.
+
+    *Returns*
+        - dict[tuple[str, int], dict[str, np.ndarray]]
+            Dictionary that uses the (replay_name, player_id) tuples as
+            keys and the columns of each player's series as values.
+
+    *Errors*
+        - KeyError
+            If one of the columns is not stored.
+    """
+    query = dict()
+    if replay_names is not None:
+        query['replay_name'] = {'$in': list(replay_names)}
+    if player_names is not None:
+        query['player_username'] = {'$in': list(player_names)}
+
+    projection = {'_id': 0, 'replay_name': 1, 'player_id': 1}
+    if columns is None:
+        projection['columns'] = 1
+    else:
+        projection.update({f'columns.{column}': 1 for column in columns})
+
+    series = dict()
+    for doc in working_db['economy'].find(query, projection):
+        stored = doc.get('columns', {})
+        series[(doc['replay_name'], doc['player_id'])] = {
+            column: decode_column(stored[column])
+            for column in (stored if columns is None else columns)}
+    return series
+
+# Internal Cell
+@dataclass
+class Processed_replay:
+    """Results of processing a replay file with `process_replay_file`.
+
+    *Attributes*
+        - replay_name (str)
+            Path to the replay file.
+        - replay_doc (Optional[dict])
+            The replay's `Replay_data` as a dictionary. None if the replay
+            is not a 1v1 match.
+        - indicators (list[dict])
+            Indicators of each of the replay's players.
+        - header_time (float)
+            Seconds spent reading the replay's header and details.
+        - load_time (float)
+            Seconds spent loading the complete replay. 0 if the replay was
+            rejected from its header.
+        - from_cache (bool = False)
+            True if the replay was loaded from an `Event_cache`.
+        - timings (Ingest_timings)
+            Time spent in each step of the replay's processing.
+        - economy (list[dict])
+            Economy time series of each of the replay's players (see
+            `extract_economy`). Empty unless they were requested.
+        - error (Optional[str] = None)
+            Type and message of the error raised while processing the
+            replay file, if it could not be processed.
+    """
+    replay_name: str
+    replay_doc: Optional[dict[str, Any]]
+    indicators: list[dict[str, Any]]
+    header_time: float
+    load_time: float = 0
+    from_cache: bool = False
+    timings: Ingest_timings = field(default_factory=Ingest_timings)
+    economy: list[dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+# Helper function that extracts the economy documents of a replay's players
+# only if they were requested.
+def extract_replay_economy(rpl: sc2reader.resources.Replay, economy: bool,
+                           timings: Ingest_timings) -> list[dict[str, Any]]:
+    if not economy:
+        return []
+    with timings.measure('economy'):
+        return extract_economy(rpl)
+
+
+# Helper function executed by the worker processes of the parallel ingest
+# mode. It must stay at module level so that the process pool can pickle it.
+def process_replay_file(rpl_file: str,
+                        cache_dir: Optional[Union[str, Path]] = None,
+                        economy: bool = False) -> Processed_replay:
+    """Loads a replay file and extracts its summary and the indicators of
+    its players.
+
+    The function reads the replay's header first and only loads the
+    complete replay if it is a 1v1 match.
+
+    If a cache_dir is given, the replay is loaded from that `Event_cache`
+    when the cache contains it. Otherwise, the events of the complete
+    replay are stored in the cache.
+
+    *Args*
+        - rpl_file (str)
+            Path to the .SC2Replay file that should be processed.
+        - cache_dir (Union[str, Path], optional)
+            Directory of the `Event_cache`. By default, no cache is used.
+        - economy (bool = False)
+            If True, the economy time series of the players are also
+            extracted (see `extract_economy`).
+
+    *Returns*
+        - Processed_replay
+            The replay's `Replay_data` as a dictionary and the list of its
+            players' indicators. Only these plain objects, and not the
+            sc2reader Replay, are sent back to the parent process.
+    """
+    timings = Ingest_timings()
+    if cache_dir is not None:
+        cache = Event_cache(cache_dir)
+        with timings.measure('hash_file'):
+            replay_hash = file_hash(rpl_file)
+        if replay_hash in cache:
+            with timings.measure('load_cache'):
+                rpl = cache.load(replay_hash, rpl_file)
+            return Processed_replay(rpl_file,
+                                    rpl.replay_doc,
+                                    extract_indicators(rpl, timings=timings),
+                                    0,
+                                    timings.seconds['load_cache'],
+                                    from_cache=True,
+                                    timings=timings,
+                                    economy=extract_replay_economy(
+                                                rpl, economy, timings))
+
+    with timings.measure('load_header'):
+        header = sc2reader.load_replay(rpl_file, load_level=1)
+
+    if not header.type == "1v1":
+        return Processed_replay(rpl_file, None, [],
+                                timings.seconds['load_header'],
+                                timings=timings)
+
+    with timings.measure('load_replay'):
+        rpl = sc2reader.load_replay(rpl_file)
+
+    replay_doc = asdict(get_replay_info(rpl))
+    indicators = extract_indicators(rpl, timings=timings)
+    economy_docs = extract_replay_economy(rpl, economy, timings)
+    if cache_dir is not None:
+        with timings.measure('store_cache'):
+            cache.store(rpl, replay_hash, replay_doc)
+
+    return Processed_replay(rpl_file,
+                            replay_doc,
+                            indicators,
+                            timings.seconds['load_header'],
+                            timings.seconds['load_replay'],
+                            timings=timings,
+                            economy=economy_docs)
+
+
+# Helper function that runs process_replay_file in the worker processes. A
+# file that cannot be processed, e.g. a corrupt or half-copied replay,
+# returns its error instead of raising it, so it does not stop the
+# processing of the other files.
+def try_process_replay_file(rpl_file: str,
+                            cache_dir: Optional[Union[str, Path]] = None,
+                            economy: bool = False) -> Processed_replay:
+    try:
+        return process_replay_file(rpl_file, cache_dir, economy)
+    except Exception as err:
+        return Processed_replay(rpl_file, None, [], 0,
+                                error=f'{type(err).__name__}: {err}')
+
+# Cell
+class Bulk_writer:
+    """Buffers the documents of the `replays`, `indicators` and `economy`
+    collections and writes them to the database with unordered bulk
+    upserts.
+
+    The writer can be used as a context manager, which writes any
+    remaining documents on exit.
+
+    *Attributes*
+        - working_db (pymongo.database.Database)
+            Database where the documents are stored.
+        - batch_size (int = 100)
+            Number of buffered replays that triggers a write.
+        - flush_interval (float = 5.0)
+            Seconds after the last write that trigger a new one when the
+            next replay is added.
+        - inserted (int)
+            Number of replays written that did not exist in the database.
+        - existing (int)
+            Number of replays written that already existed in the database.
+    """
+    def __init__(self, working_db: pymongo.database.Database,
+                 batch_size: int = 100, flush_interval: float = 5.0):
+        self.working_db = working_db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.inserted = 0
+        self.existing = 0
+        self._replays_ops = []
+        self._indicators_ops = []
+        self._economy_ops = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+        ensure_indexes(working_db)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add_replay(self, replay_doc: dict[str, Any],
+                   players_indicators: list[dict[str, Any]],
+                   replace: bool = False,
+                   economy: Sequence[dict[str, Any]] = ()) -> None:
+        """Buffers a replay's summary, its players' indicators and,
+        optionally, their economy series (see `extract_economy`).
+
+        By default, the documents are only written if they do not exist
+        in the database. If replace is True, they overwrite any existing
+        documents of the same replay."""
+        self._replays_ops.append(
+            self._upsert({'replay_name': replay_doc['replay_name']},
+                         replay_doc, replace))
+        self.add_indicators(players_indicators, replace, economy)
+
+    def add_indicators(self, players_indicators: list[dict[str, Any]],
+                       replace: bool = False,
+                       economy: Sequence[dict[str, Any]] = ()) -> None:
+        """Buffers the indicators, and optionally the economy series, of a
+        replay's players, without the replay's summary. The replace
+        argument works as in `add_replay`."""
+        self._economy_ops.extend(
+            self._upsert({'replay_name': series['replay_name'],
+                          'player_id': series['player_id']},
+                         series, replace)
+            for series in economy)
+        self._indicators_ops.extend(
+            self._upsert({'replay_name': indicators['replay_name'],
+                          'player_id': indicators['player_id']},
+                         indicators, replace)
+            for indicators in players_indicators)
+        self._buffered += 1
+
+        if (self._buffered >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    @staticmethod
+    def _upsert(key: dict[str, Any], doc: dict[str, Any], replace: bool) \
+                -> Union[pymongo.UpdateOne, pymongo.ReplaceOne]:
+        if replace:
+            return pymongo.ReplaceOne(key, doc, upsert=True)
+        return pymongo.UpdateOne(key, {'$setOnInsert': doc}, upsert=True)
+
+    def flush(self) -> None:
+        """Writes all the buffered documents to the database."""
+        if self._economy_ops:
+            self._bulk_upsert('economy', self._economy_ops)
+        if self._indicators_ops:
+            self._bulk_upsert('indicators', self._indicators_ops)
+        if self._replays_ops:
+            inserted = self._bulk_upsert('replays', self._replays_ops)
+            self.inserted += inserted
+            self.existing += len(self._replays_ops) - inserted
+
+        self._replays_ops = []
+        self._indicators_ops = []
+        self._economy_ops = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def _bulk_upsert(self, collection: str,
+                     operations: list[Union[pymongo.UpdateOne,
+                                            pymongo.ReplaceOne]]) -> int:
+        """Runs the operations as an unordered bulk write and returns the
+        number of new documents. Duplicate key errors, caused by other
+        processes inserting the same documents, are ignored."""
+        try:
+            result = (self.working_db[collection]
+                      .bulk_write(operations, ordered=False)
+                      .bulk_api_result)
+        except pymongo.errors.BulkWriteError as err:
+            result = err.details
+            if any(error['code'] != 11000 for error in result['writeErrors']):
+                raise err
+
+        return result['nUpserted']
+
+# Cell
+class Bloom_filter:
+    """Compact, probabilistic set of strings.
+
+    The filter never misses a string that was added to it, but it can
+    report that it contains a string that was never added, with a
+    probability close to `error_rate`.
+
+    *Attributes*
+        - capacity (int)
+            Number of strings the filter is designed to store.
+        - error_rate (float = 0.001)
+            Expected false positive rate when the filter stores `capacity`
+            strings.
+    """
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate)
+                               / math.log(2)**2))
+        self.hash_count = max(1, round(self.size / self.capacity
+                                       * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size
+                for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+# Internal Cell
+# Helper functions that drop the replay files already stored in the
+# replays collection before they are parsed.
+def load_known_replays(rpls_collect: pymongo.collection.Collection,
+                       max_exact: int = 100_000) \
+                       -> Union[set[str], Bloom_filter]:
+    """Loads the names of the replays stored in the collection with a
+    single query. Uses a `Bloom_filter` if there are more than max_exact
+    names."""
+    known_count = rpls_collect.estimated_document_count()
+    names = (doc['replay_name'] for doc
+             in rpls_collect.find({}, {'replay_name': 1, '_id': 0}))
+
+    if known_count <= max_exact:
+        return set(names)
+
+    known = Bloom_filter(known_count)
+    for name in names:
+        known.add(name)
+    return known
+
+
+def filter_new_replays(rpl_files: Iterable[str],
+                       rpls_collect: pymongo.collection.Collection,
+                       max_exact: int = 100_000) -> list[str]:
+    """Lists the replay files that are not stored in the collection,
+    keeping their original order."""
+    rpl_files = list(rpl_files)
+    known = load_known_replays(rpls_collect, max_exact)
+
+    if isinstance(known, Bloom_filter):
+        # Confirm the names recognised by the filter to avoid dropping new
+        # replays because of false positives.
+        known = find_known_replays([f for f in rpl_files if f in known],
+                                   rpls_collect)
+
+    return [f for f in rpl_files if f not in known]
+
+
+def find_known_replays(rpl_files: Iterable[str],
+                       rpls_collect: pymongo.collection.Collection,
+                       batch_size: int = 1000) -> set[str]:
+    """Finds which of the given replay names are stored in the collection,
+    querying only for those names in batches of batch_size."""
+    rpl_files = list(rpl_files)
+    known = set()
+    for i in range(0, len(rpl_files), batch_size):
+        known.update(doc['replay_name'] for doc
+                     in rpls_collect.find(
+                         {'replay_name': {'$in': rpl_files[i:i+batch_size]}},
+                         {'replay_name': 1, '_id': 0}))
+    return known
+
+# Internal Cell
+# Helper generator that processes a list of replay files in the current
+# process or, if more than one worker is requested, in a process pool.
+def process_replay_files(rpl_files: Iterable[str], workers: int = 1,
+                         cache_dir: Optional[Union[str, Path]] = None,
+                         economy: bool = False) \
+                         -> Iterator[Processed_replay]:
+    process = partial(try_process_replay_file, cache_dir=cache_dir,
+                      economy=economy)
+    if workers > 1:
+        # Each worker sets up the sc2reader plug-ins, since the processes
+        # may be spawned instead of forked.
+        with multiprocessing.Pool(workers, initializer=set_up_plugins) as pool:
+            yield from pool.imap_unordered(process, rpl_files)
+    else:
+        yield from map(process, rpl_files)
+
+# Internal Cell
+@dataclass
+class Ingest_summary:
+    """Counters that summarise the results of an ingest run.
+
+    *Attributes*
+        - processed (int)
+            Number of replay files found.
+        - loaded (int)
+            Number of replays stored in the database.
+        - ignored (int)
+            Number of replays ignored because they are not 1v1 matches.
+        - existing (int)
+            Number of replays that already existed in the database.
+        - full_loads (int)
+            Number of 1v1 replays that were loaded completely.
+        - header_time (float)
+            Seconds spent reading the headers of the ignored replays.
+        - load_time (float)
+            Seconds spent loading the 1v1 replays completely.
+        - cache_hits (int)
+            Number of replays loaded from the `Event_cache`.
+        - failed (int)
+            Number of replay files that could not be processed.
+        - errors (dict[str, str])
+            Error raised by each replay file whose last processing
+            failed.
+        - timings (Ingest_timings)
+            Time spent in each step of the processing of all the replays.
+    """
+    processed: int = 0
+    loaded: int = 0
+    ignored: int = 0
+    existing: int = 0
+    full_loads: int = 0
+    header_time: float = 0
+    load_time: float = 0
+    cache_hits: int = 0
+    failed: int = 0
+    errors: dict[str, str] = field(default_factory=dict)
+    timings: Ingest_timings = field(default_factory=Ingest_timings)
+
+    def __str__(self):
+        lines = [f'{self.processed} files processed',
+                 f'{self.loaded} files loaded',
+                 f'{self.ignored} files ignored',
+                 f'{self.existing} files alredy existed']
+        if self.cache_hits:
+            lines.append(f'{self.cache_hits} files read from the event cache')
+        if self.failed:
+            lines.append(f'{self.failed} files could not be processed')
+        if self.ignored and self.full_loads:
+            # Estimate the time the ignored replays would have taken to load
+            # completely with the average load time of the 1v1 replays.
+            saved = (self.ignored * (self.load_time / self.full_loads)
+                     - self.header_time)
+            lines.append(f'Reading only the headers of ignored files saved '
+                         f'about {saved:.1f} seconds')
+        return '\n'.join(lines)
+
+
+# Helper function that processes a list of replay files and buffers their
+# results in a Bulk_writer, updating the counters of an Ingest_summary.
+def ingest_replay_files(rpl_files: Iterable[str],
+                        writer: Bulk_writer,
+                        summary: Ingest_summary,
+                        workers: int = 1,
+                        replace: bool = False,
+                        cache_dir: Optional[Union[str, Path]] = None,
+                        economy: bool = False) -> None:
+    for result in process_replay_files(rpl_files, workers, cache_dir,
+                                       economy):
+        summary.timings.merge(result.timings)
+        if result.error is not None:
+            print(f'Could not process {result.replay_name}: {result.error}')
+            summary.failed += 1
+            summary.errors[result.replay_name] = result.error
+            continue
+        summary.errors.pop(result.replay_name, None)
+        if result.replay_doc is None:
+            summary.ignored += 1
+            summary.header_time += result.header_time
+            continue
+        if result.from_cache:
+            summary.cache_hits += 1
+        else:
+            summary.full_loads += 1
+            summary.load_time += result.load_time
+        writer.add_replay(result.replay_doc, result.indicators, replace,
+                          result.economy)
 
 # Cell
-def inventory_replays() -> None:
+def inventory_replays(workers: int = 1,
+                      cache_dir: Optional[Union[str, Path]] = None,
+                      economy: bool = False) -> Ingest_summary:
     """This function builds two collections within the database
     specified in the config.json file.
 
@@ -256,47 +1081,741 @@ def inventory_replays() -> None:
         for finding the other replays.
     - `inicators`
         Store the indicators for each performance of every player.
+    - `economy`
+        Optionally, stores the economy time series of every player.
+
+    Replay files that are already stored in the database are dropped
+    before they are parsed (see `filter_new_replays`). The rest of the
+    documents are stored in bulk with a `Bulk_writer`, so replays that
+    already exist in the database are not duplicated.
 
     *Args:*
-        - replay_batch
-            Directory address where the replays to process are located.
+        - workers (int = 1)
+            Number of processes used to parse the replays and extract
+            their indicators. With the default value, the replays are
+            processed serially in the current process. With more workers,
+            each process parses whole replays and only sends their
+            summaries and indicators back to this process, which stores
+            them in the database.
+        - cache_dir (Union[str, Path], optional)
+            Directory of an `Event_cache`. If given, the events of the
+            parsed replays are stored in the cache, and the replays that
+            are already in the cache are loaded from it instead of being
+            parsed again.
+        - economy (bool = False)
+            If True, the economy time series of each player are also
+            stored in the `economy` collection (see `load_economy`).
 
     *Return:*
-        -None
+        - Ingest_summary
+            Counters of the replays processed and the time spent in each
+            step of their processing (see `Ingest_timings`).
 
+    *Errors*
+        - ValueError
+            If workers is smaller than 1.
     """
+    if workers < 1:
+        raise ValueError(f'workers must be 1 or greater, not {workers}')
+
     project_config = load_configurations()
     working_db = set_up_db()
-    rpls_collect = working_db['replays']
+    set_up_plugins()
     path = verify_replays_path(project_config.replay_path)
 
-    replays = sc2reader.load_replays(str(path))
-
-    load_count = 0
-    process_count = 0
-    previous = 0
-    ignored = 0
+    rpl_files = list(sc2reader.utils.get_files(str(path),
+                                               extension='SC2Replay'))
 
     print(f'Inventorying replays at: {path} in database {working_db.name}')
 
-    for rpl in replays:
-        process_count += 1
-        if (not (rpl.type == "1v1")):
-            ignored += 1
-            # print(f'{rpl.filename}is not 1v1')
-            continue
-        if not rpls_collect.count_documents({'replay_name': rpl.filename},
-                                            limit = 1):
-            # print(f'Processing {rpl.filename}')
-            rpls_collect.insert_one(asdict(get_replay_info(rpl)))
-            build_indicators(rpl, working_db)
-            load_count += 1
-        else:
-            previous += 1
-            # print(rpl.filename, "already exists in the replay_info rpls_collect.")
+    new_files = filter_new_replays(rpl_files, working_db['replays'])
+    summary = Ingest_summary(processed=len(rpl_files),
+                             existing=len(rpl_files) - len(new_files))
+
+    with Bulk_writer(working_db) as writer:
+        ingest_replay_files(new_files, writer, summary, workers,
+                            cache_dir=cache_dir, economy=economy)
+
+    summary.loaded += writer.inserted
+    summary.existing += writer.existing
 
     print(f'Load complete.')
-    print(f'{process_count} files processed')
-    print(f'{load_count} files loaded')
-    print(f'{ignored} files ignored')
-    print(f'{previous} files alredy existed')
+    print(summary)
+    print(summary.timings)
+    return summary
+
+# Internal Cell
+# Helper function that computes the content hash of a file.
+def file_hash(file_path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Cell
+class Replay_manifest:
+    """Persistent record of the replay files found under a directory.
+
+    *Args*
+        - manifest_file (Union[str, Path], optional)
+            JSON file where the manifest is stored. Defaults to
+            cwd/data/ingest_manifest.json. If the file exists, the
+            manifest is loaded from it.
+        - settle_time (float = 2.0)
+            Files modified less than this number of seconds ago are not
+            reported until a later scan.
+
+    *Attributes*
+        - dirs (dict[str, dict])
+            Maps each visited directory to its modification time
+            ('mtime'), its subdirectories ('subdirs') and the size,
+            modification time, content hash and processing error of each
+            of its replay files, indexed by file name ('files'). The
+            files that were not hashed yet have no record.
+        - dirty (bool)
+            True if the manifest changed since it was loaded or saved.
+    """
+    # Version of the manifest's JSON format. Manifests stored with other
+    # versions are discarded, and the directories are scanned again.
+    version = 2
+
+    def __init__(self, manifest_file: Optional[Union[str, Path]] = None,
+                 settle_time: float = 2.0):
+        if manifest_file is None:
+            manifest_file = Path.cwd()/'data'/'ingest_manifest.json'
+        self.manifest_file = Path(manifest_file)
+        self.settle_time = settle_time
+        self.dirs = {}
+        self.dirty = False
+
+        if self.manifest_file.exists():
+            with self.manifest_file.open('r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == self.version:
+                self.dirs = manifest['dirs']
+
+    def scan(self, root: Union[str, Path],
+             full_check: bool = False) -> tuple[list[str], list[str]]:
+        """Finds the replay files under root that are new or that changed
+        since the last scan.
+
+        Only the files of the directories whose modification time changed,
+        or that had unsettled files in the last scan, are checked. Files
+        overwritten in place do not change their directory, so they are
+        only found by a full check.
+
+        *Args*
+            - root (Union[str, Path])
+                Directory that contains the replay files.
+            - full_check (bool = False)
+                If True, the size and modification time of the files of
+                every directory are checked.
+
+        *Returns*
+            - tuple[list[str], list[str]]
+                Paths of the new files and paths of the changed files.
+        """
+        new_files, changed_files = [], []
+        now = time.time()
+        pending = [str(root)]
+        while pending:
+            directory = pending.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime
+            except FileNotFoundError:
+                self._forget_dir(directory)
+                continue
+
+            record = self.dirs.get(directory)
+            if record is None or record['mtime'] != dir_mtime:
+                record = self._list_dir(directory, record)
+                self.dirs[directory] = record
+                self.dirty = True
+            elif not full_check:
+                pending.extend(record['subdirs'])
+                continue
+
+            settled = self._check_files(directory, record['files'], now,
+                                        new_files, changed_files)
+            # Directories with files that are still being written are
+            # listed again in the next scan.
+            record['mtime'] = dir_mtime if settled else None
+            pending.extend(record['subdirs'])
+
+        return new_files, changed_files
+
+    def record_error(self, path: str, error: str) -> None:
+        """Records the error raised while processing a replay file. The
+        file is not reported again until it changes."""
+        directory, name = os.path.split(path)
+        recorded = self.dirs.get(directory, {}).get('files', {}).get(name)
+        if recorded is not None:
+            recorded[3] = error
+            self.dirty = True
+
+    @property
+    def errors(self) -> dict[str, str]:
+        """Errors recorded for the replay files that could not be
+        processed since they last changed."""
+        return {os.path.join(directory, name): recorded[3]
+                for directory, record in self.dirs.items()
+                for name, recorded in record['files'].items()
+                if recorded is not None and recorded[3] is not None}
+
+    def save(self) -> None:
+        """Writes the manifest to its JSON file, unless it did not change
+        since it was loaded or saved."""
+        if not self.dirty and self.manifest_file.exists():
+            return
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.manifest_file.with_suffix('.tmp')
+        with temp_file.open('w') as f:
+            json.dump({'version': self.version, 'dirs': self.dirs}, f)
+        os.replace(temp_file, self.manifest_file)
+        self.dirty = False
+
+    def _list_dir(self, directory: str,
+                  record: Optional[dict[str, Any]]) -> dict[str, Any]:
+        """Lists a directory, keeping the records of the replay files that
+        are still in it. Subdirectories that disappeared are forgotten."""
+        subdirs, names = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith('.sc2replay'):
+                    names.append(entry.name)
+
+        known_files = record['files'] if record is not None else {}
+        for subdir in set(record['subdirs'] if record is not None else [])\
+                      - set(subdirs):
+            self._forget_dir(subdir)
+
+        return {'mtime': None, 'subdirs': subdirs,
+                'files': {name: known_files.get(name) for name in names}}
+
+    def _check_files(self, directory: str,
+                     files: dict[str, Optional[list]], now: float,
+                     new_files: list[str], changed_files: list[str]) -> bool:
+        """Hashes the files of a directory whose size or modification time
+        changed. Returns whether all the files are settled."""
+        settled = True
+        for name, recorded in list(files.items()):
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del files[name]
+                self.dirty = True
+                continue
+
+            if now - stat.st_mtime < self.settle_time:
+                settled = False
+                continue
+            if (recorded is not None
+                and recorded[:2] == [stat.st_size, stat.st_mtime]):
+                continue
+
+            digest = file_hash(path)
+            files[name] = [stat.st_size, stat.st_mtime, digest, None]
+            self.dirty = True
+            if recorded is None:
+                new_files.append(path)
+            elif recorded[2] != digest:
+                changed_files.append(path)
+
+        return settled
+
+    def _forget_dir(self, directory: str) -> None:
+        """Removes a directory and everything under it from the manifest."""
+        prefix = os.path.join(directory, '')
+        dirs = {path: record for path, record in self.dirs.items()
+                if path != directory and not path.startswith(prefix)}
+        self.dirty |= len(dirs) != len(self.dirs)
+        self.dirs = dirs
+
+# Cell
+def watch_replays(interval: float = 5.0,
+                  workers: int = 1,
+                  manifest_file: Optional[Union[str, Path]] = None,
+                  max_polls: Optional[int] = None,
+                  cache_dir: Optional[Union[str, Path]] = None,
+                  economy: bool = False,
+                  full_check_every: int = 12) -> Ingest_summary:
+    """Keeps the database specified in the config.json file up to date
+    with the replay path, ingesting new and changed replay files as they
+    appear.
+
+    The replays are stored in the same collections and in the same way
+    as in `inventory_replays`. New files that are already stored in the
+    database are skipped, while files whose contents changed replace
+    their previous documents. The function runs until it is interrupted
+    or until it completes max_polls polls.
+
+    *Args:*
+        - interval (float = 5.0)
+            Seconds to wait between polls.
+        - workers (int = 1)
+            Number of processes used to parse the replays (see
+            `inventory_replays`).
+        - manifest_file (Union[str, Path], optional)
+            JSON file where the `Replay_manifest` is stored. Defaults to
+            cwd/data/ingest_manifest.json.
+        - max_polls (int, optional)
+            Number of polls after which the function returns. By default,
+            it polls until it is interrupted.
+        - cache_dir (Union[str, Path], optional)
+            Directory of an `Event_cache` (see `inventory_replays`).
+        - economy (bool = False)
+            If True, the economy time series of the players are also
+            stored (see `inventory_replays`).
+        - full_check_every (int = 12)
+            Number of polls between the full checks of the known files
+            (see `Replay_manifest.scan`), including the first poll. Files
+            overwritten in place are only found by these checks, so they
+            are ingested up to full_check_every polls late (a minute with
+            the default interval).
+
+    *Return:*
+        - Ingest_summary
+            Counters of the replays ingested while watching.
+
+    *Errors*
+        - ValueError
+            If workers or full_check_every are smaller than 1.
+    """
+    if workers < 1:
+        raise ValueError(f'workers must be 1 or greater, not {workers}')
+    if full_check_every < 1:
+        raise ValueError(f'full_check_every must be 1 or greater, '
+                         f'not {full_check_every}')
+
+    project_config = load_configurations()
+    working_db = set_up_db()
+    set_up_plugins()
+    path = verify_replays_path(project_config.replay_path)
+    manifest = Replay_manifest(manifest_file)
+    summary = Ingest_summary()
+
+    print(f'Watching replays at: {path} in database {working_db.name}')
+
+    polls = 0
+    with Bulk_writer(working_db) as writer:
+        try:
+            while max_polls is None or polls < max_polls:
+                full_check = polls % full_check_every == 0
+                new_files, changed_files = manifest.scan(path, full_check)
+                if new_files or changed_files:
+                    print(f'{len(new_files)} new and {len(changed_files)} '
+                          f'changed files found')
+                    # Only the names found in this poll are looked up, instead
+                    # of loading every name stored in the database.
+                    known = find_known_replays(new_files,
+                                               working_db['replays'])
+                    fresh_files = [f for f in new_files if f not in known]
+                    summary.processed += len(new_files) + len(changed_files)
+                    summary.existing += len(new_files) - len(fresh_files)
+                    ingest_replay_files(fresh_files, writer, summary,
+                                        workers, cache_dir=cache_dir,
+                                        economy=economy)
+                    ingest_replay_files(changed_files, writer, summary,
+                                        workers, replace=True,
+                                        cache_dir=cache_dir,
+                                        economy=economy)
+                    writer.flush()
+                    for rpl_file in new_files + changed_files:
+                        if rpl_file in summary.errors:
+                            manifest.record_error(rpl_file,
+                                                  summary.errors[rpl_file])
+                # The manifest is only saved once the results are written,
+                # so files are scanned again if the watcher stops earlier.
+                # Idle polls do not change it, so they do not write it.
+                manifest.save()
+
+                polls += 1
+                if max_polls is None or polls < max_polls:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            print('Watching stopped.')
+
+    summary.loaded += writer.inserted
+    summary.existing += writer.existing
+
+    print(summary)
+    print(summary.timings)
+    return summary
+
+# Internal Cell
+# Version of the format written by extract_event_columns. It must be
+# increased whenever the stored columns, or the indicators computed from
+# them, change, so the caches written by older versions are rebuilt. The
+# caches written before the format had a version count as version 1.
+EVENT_CACHE_VERSION = 2
+
+# Helper function that extracts the columns stored in the Event_cache from
+# a parsed replay.
+def extract_event_columns(rpl: sc2reader.resources.Replay,
+                          replay_doc: Optional[dict[str, Any]] = None) \
+                          -> dict[str, np.ndarray]:
+    strings = {}
+    code = lambda s: -1 if s is None else strings.setdefault(s, len(strings))
+    columns = {}
+
+    def add_table(name: str, rows: list[dict[str, Any]],
+                  dtypes: dict[str, type]) -> None:
+        for key, dtype in dtypes.items():
+            columns[f'{name}_{key}'] = np.array([row[key] for row in rows],
+                                                dtype=dtype)
+
+    pstatse = get_events(rpl, sc2reader.events.tracker.PlayerStatsEvent)
+    stats_attrs = {key: type(value) for key, value
+                   in (pstatse[0].__dict__.items() if pstatse else [])
+                   if type(value) in (int, float)}
+    add_table('pstatse', [e.__dict__ for e in pstatse],
+              {key: np.int64 if dtype == int else np.float64
+               for key, dtype in stats_attrs.items()})
+
+    add_table('upgrades',
+              [{'pid': e.pid, 'second': e.second,
+                'name': code(e.upgrade_type_name)}
+               for e in get_events(rpl,
+                                   sc2reader.events.tracker
+                                   .UpgradeCompleteEvent)],
+              {'pid': np.int64, 'second': np.int64, 'name': np.int32})
+
+    game_classes = (sc2reader.events.game.CommandEvent,
+                    sc2reader.events.game.SelectionEvent,
+                    sc2reader.events.game.ControlGroupEvent,
+                    sc2reader.events.game.PlayerLeaveEvent)
+    ability = lambda e: getattr(e, 'ability', None)
+    add_table('game',
+              [{'type': code(type(e).__name__),
+                'pid': e.player.pid if e.player else -1,
+                'frame': e.frame,
+                'second': e.second,
+                'ability_name': code(getattr(e, 'ability_name', None)),
+                'ability': code(ability(e).name) if ability(e) else -1,
+                'is_build': ability(e).is_build if ability(e) else False,
+                'control_group': getattr(e, 'control_group', -1)}
+               for e in get_events(rpl, sc2reader.events.game.GameEvent)
+               if isinstance(e, game_classes)],
+              {'type': np.int32, 'pid': np.int64, 'frame': np.int64,
+               'second': np.int64, 'ability_name': np.int32,
+               'ability': np.int32, 'is_build': bool,
+               'control_group': np.int64})
+
+    frame = lambda f: np.nan if f is None else f
+    add_table('units',
+              [{'pid': pid, 'id': u.id, 'name': code(u.name),
+                'started_at': frame(u.started_at),
+                'finished_at': frame(u.finished_at),
+                'died_at': frame(u.died_at),
+                'is_building': u.is_building,
+                'hallucinated': (int(u.hallucinated)
+                                 if 'hallucinated' in u.__dict__ else -1)}
+               for pid, player in rpl.player.items()
+               for u in player.units],
+              {'pid': np.int64, 'id': np.int64, 'name': np.int32,
+               'started_at': np.float64, 'finished_at': np.float64,
+               'died_at': np.float64, 'is_building': bool,
+               'hallucinated': np.int8})
+
+    add_table('ctrlg',
+              [{'pid': pid, 'second': second, 'group': group,
+                'size': size}
+               for pid, history in getattr(rpl, 'ctrl_grp_trk', {}).items()
+               for second, group, size in history.changes],
+              {'pid': np.int64, 'second': np.int64, 'group': np.int64,
+               'size': np.int64})
+
+    if replay_doc is not None and replay_doc['date_time'] is not None:
+        replay_doc = dict(replay_doc,
+                          date_time=replay_doc['date_time'].isoformat())
+
+    meta = {'version': EVENT_CACHE_VERSION,
+            'filename': rpl.filename,
+            'length': rpl.length.seconds,
+            'game_fps': rpl.game_fps,
+            'players': [{'pid': pid,
+                         'name': player.name,
+                         'play_race': player.play_race,
+                         'is_human': player.is_human}
+                        for pid, player in rpl.player.items()],
+            'replay_doc': replay_doc}
+
+    columns['meta'] = np.array(json.dumps(meta))
+    columns['strings'] = np.array(list(strings), dtype=str)
+    return columns
+
+# Cell
+class Cached_replay:
+    """Stand-in for a `sc2reader` Replay rebuilt from the columns stored
+    in an `Event_cache`.
+
+    The object offers the attributes of the replay, its players, units and
+    events that the indicator functions use. Its `event_index` is built
+    with the `sc2reader` event classes as keys, so `get_events` works on it
+    as it does on a parsed replay.
+
+    *Args*
+        - columns (Mapping[str, np.ndarray])
+            Columns of the replay's events (see `Event_cache`).
+        - filename (str, optional)
+            Path of the replay file. Defaults to the path stored in the
+            cache.
+
+    *Attributes*
+        - filename (str)
+        - length (timedelta)
+        - game_fps (float)
+        - player (dict[int, SimpleNamespace])
+        - ctrl_grp_trk (dict[int, Ctrl_group_history])
+            Size of the control groups tracked by the `CtrlGroupTracker`
+            plugin.
+        - replay_doc (Optional[dict])
+            The replay's `Replay_data` as a dictionary.
+        - event_index (dict[tuple[type, Optional[int]], list])
+    """
+    def __init__(self, columns: Mapping[str, np.ndarray],
+                 filename: Optional[str] = None):
+        meta = json.loads(str(columns['meta']))
+        strings = columns['strings'].tolist()
+        string = lambda code: strings[code] if code >= 0 else None
+
+        self.filename = filename or meta['filename']
+        self.length = timedelta(seconds=meta['length'])
+        self.game_fps = meta['game_fps']
+        self.replay_doc = meta['replay_doc']
+        if self.replay_doc is not None:
+            if self.replay_doc['date_time'] is not None:
+                self.replay_doc['date_time'] = datetime.fromisoformat(
+                                                self.replay_doc['date_time'])
+            self.replay_doc['replay_name'] = self.filename
+            self.replay_doc['replay_id'] = Path(self.filename).name
+            # Caches written before the players' usernames were flagged.
+            for player in self.replay_doc['players']:
+                player.setdefault('is_eligible_name',
+                                  is_eligible_name(player['username']))
+
+        self.player = {p['pid']: SimpleNamespace(pid=p['pid'],
+                                                 name=p['name'],
+                                                 play_race=p['play_race'],
+                                                 is_human=p['is_human'],
+                                                 units=[])
+                       for p in meta['players']}
+
+        table = lambda name: {key[len(name) + 1:]: columns[key].tolist()
+                              for key in columns
+                              if key.startswith(f'{name}_')}
+
+        units = table('units')
+        for pid, uid, name, started, finished, died, building, halluc \
+            in zip(units['pid'], units['id'], units['name'],
+                   units['started_at'], units['finished_at'],
+                   units['died_at'], units['is_building'],
+                   units['hallucinated']):
+            unit = SimpleNamespace(id=uid, name=string(name),
+                                   started_at=_frame(started),
+                                   finished_at=_frame(finished),
+                                   died_at=_frame(died),
+                                   is_building=building)
+            if halluc >= 0:
+                unit.hallucinated = bool(halluc)
+            self.player[pid].units.append(unit)
+
+        self.ctrl_grp_trk = {}
+        ctrlg = table('ctrlg')
+        for pid, second, group, size in zip(ctrlg['pid'], ctrlg['second'],
+                                            ctrlg['group'], ctrlg['size']):
+            (self.ctrl_grp_trk.setdefault(pid, Ctrl_group_history())
+                              .update(second, group, size))
+
+        self.event_index = {}
+        pstatse = table('pstatse')
+        self._index_events(sc2reader.events.tracker.PlayerStatsEvent,
+                           [SimpleNamespace(**dict(zip(pstatse, values)))
+                            for values in zip(*pstatse.values())])
+
+        upgrades = table('upgrades')
+        self._index_events(sc2reader.events.tracker.UpgradeCompleteEvent,
+                           [SimpleNamespace(pid=pid, second=second,
+                                            upgrade_type_name=string(name))
+                            for pid, second, name
+                            in zip(upgrades['pid'], upgrades['second'],
+                                   upgrades['name'])])
+
+        game = table('game')
+        for event_type, pid, frame, second, ability_name, ability, \
+            is_build, control_group \
+            in zip(game['type'], game['pid'], game['frame'], game['second'],
+                   game['ability_name'], game['ability'], game['is_build'],
+                   game['control_group']):
+            event_class = getattr(sc2reader.events.game, string(event_type))
+            event = SimpleNamespace(name=string(event_type), frame=frame,
+                                    second=second,
+                                    player=self.player.get(pid))
+            if issubclass(event_class, sc2reader.events.game.CommandEvent):
+                event.ability_name = string(ability_name)
+                event.ability = (SimpleNamespace(name=string(ability),
+                                                 is_build=is_build)
+                                 if ability >= 0 else None)
+            else:
+                event.control_group = control_group
+            self._index_event(event_class, event, pid)
+
+    def _index_events(self, event_class: type, events: list) -> None:
+        for event in events:
+            self._index_event(event_class, event, event.pid)
+
+    def _index_event(self, event_class: type, event: SimpleNamespace,
+                     pid: int) -> None:
+        for cls in event_class.__mro__[:-1]:
+            self.event_index.setdefault((cls, None), []).append(event)
+            if pid >= 0:
+                self.event_index.setdefault((cls, pid), []).append(event)
+
+
+# Helper function that converts the frames stored in the cache back into
+# the values of the units' attributes.
+def _frame(value: float) -> Optional[int]:
+    return None if np.isnan(value) else int(value)
+
+# Cell
+class Event_cache:
+    """On-disk cache of the replay events used by the indicator functions,
+    stored in a columnar format and keyed by the content hash of the
+    replay files.
+
+    Each file stores the version of the format it was written with. The
+    files written with another version are treated as missing, so their
+    replays are parsed and stored again.
+
+    *Args*
+        - cache_dir (Union[str, Path], optional)
+            Directory where the cached replays are stored. Defaults to
+            cwd/data/event_cache.
+    """
+    def __init__(self, cache_dir: Optional[Union[str, Path]] = None):
+        if cache_dir is None:
+            cache_dir = Path.cwd()/'data'/'event_cache'
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def path(self, replay_hash: str) -> Path:
+        """Path of the file that stores the events of a replay."""
+        return self.cache_dir/f'{replay_hash}.npz'
+
+    def version(self, replay_hash: str) -> Optional[int]:
+        """Version of the format of the file that stores the events of a
+        replay, or None if the replay is not in the cache."""
+        path = self.path(replay_hash)
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as columns:
+            return json.loads(str(columns['meta'])).get('version', 1)
+
+    def __contains__(self, replay_hash: str) -> bool:
+        return self.version(replay_hash) == EVENT_CACHE_VERSION
+
+    def __iter__(self) -> Iterator[str]:
+        return (path.stem for path in sorted(self.cache_dir.glob('*.npz'))
+                if path.stem in self)
+
+    def store(self, rpl: sc2reader.resources.Replay, replay_hash: str,
+              replay_doc: Optional[dict[str, Any]] = None) -> Path:
+        """Stores the events of a parsed replay, and optionally its
+        `Replay_data` dictionary, under the replay file's hash.
+
+        *Returns*
+            - Path
+                Path of the file that stores the replay's events.
+        """
+        path = self.path(replay_hash)
+        # Write to a temporary file first so other processes never read
+        # an incomplete file.
+        temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with temp_path.open('wb') as f:
+            np.savez_compressed(f, **extract_event_columns(rpl, replay_doc))
+        os.replace(temp_path, path)
+        return path
+
+    def load(self, replay_hash: str,
+             filename: Optional[str] = None) -> Cached_replay:
+        """Loads the events of a replay as a `Cached_replay`.
+
+        *Errors*
+            - KeyError
+                If the replay is not in the cache, or it was stored with
+                another version of the format.
+        """
+        if replay_hash not in self:
+            raise KeyError(f'{replay_hash} is not in the event cache')
+        with np.load(self.path(replay_hash), allow_pickle=False) as columns:
+            return Cached_replay(columns, filename)
+
+# Internal Cell
+# Helper function executed by the worker processes of rescore_replays. It
+# returns the indicators and, if requested, the economy series of a replay.
+def rescore_cached_replay(cache_file: Path, economy: bool = False) \
+                          -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    with np.load(cache_file, allow_pickle=False) as columns:
+        rpl = Cached_replay(columns)
+        return (extract_indicators(rpl),
+                extract_economy(rpl) if economy else [])
+
+# Cell
+def rescore_replays(cache_dir: Optional[Union[str, Path]] = None,
+                    workers: int = 1, economy: bool = False) -> int:
+    """Recomputes the indicators of all the replays stored in the event
+    cache and replaces them in the indicators collection of the database
+    specified in the config.json file.
+
+    The indicators are computed from `Cached_replay` objects, so the
+    replay files are not parsed again. The files written with another
+    version of the cache format are skipped, since they are rebuilt the
+    next time their replays are ingested.
+
+    *Args:*
+        - cache_dir (Union[str, Path], optional)
+            Directory of the `Event_cache`. Defaults to
+            cwd/data/event_cache.
+        - workers (int = 1)
+            Number of processes used to compute the indicators.
+        - economy (bool = False)
+            If True, the economy time series of the players are also
+            stored, so they can be added to replays ingested without them.
+
+    *Return:*
+        - int
+            Number of replays rescored.
+
+    *Errors*
+        - ValueError
+            If workers is smaller than 1.
+    """
+    if workers < 1:
+        raise ValueError(f'workers must be 1 or greater, not {workers}')
+
+    working_db = set_up_db()
+    cache = Event_cache(cache_dir)
+    cache_files = [cache.path(replay_hash) for replay_hash in cache]
+
+    print(f'Rescoring {len(cache_files)} cached replays '
+          f'in database {working_db.name}')
+
+    rescore = partial(rescore_cached_replay, economy=economy)
+    with Bulk_writer(working_db) as writer:
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                for indicators, economy_docs in pool.imap_unordered(
+                                                    rescore, cache_files):
+                    writer.add_indicators(indicators, replace=True,
+                                          economy=economy_docs)
+        else:
+            for indicators, economy_docs in map(rescore, cache_files):
+                writer.add_indicators(indicators, replace=True,
+                                      economy=economy_docs)
+
+    print('Rescore complete.')
+    return len(cache_files)
\ No newline at end of file
@@ -9,7 +9,8 @@ from pprint import pprint
 from dataclasses import dataclass, astuple, field
 from datetime import datetime
 from typing import *
-from fastcore import test as ft
+
+import operator
 
 import pandas as pd
 import numpy as np
@@ -40,70 +41,91 @@ def get_pstatse(rpl: sc2reader.resources.Replay,
             replay.
     """
 
-    return [event for event in rpl.events
-            if isinstance(event, sc2reader.events.tracker.PlayerStatsEvent)
-            and event.pid == current_pid]
+    return get_events(rpl, sc2reader.events.tracker.PlayerStatsEvent,
+                      current_pid)
 
 # Internal Cell
 
-def complete_pstatse_df(rpl: sc2reader.resources.Replay,
-                        df: pd.DataFrame) -> pd.DataFrame:
-    """Expands the initial DataFrame that can be extracted directly from
-    the PlayerStatsEvents with several relevant features.
-
-    This function uses the replay data to compose several features time
-    series that can facilitate the extraction of macroeconomic stats later.
-    The function adds the following columns to the macroeconomic stats
-    DataFrame extracted from the PlayerStatsEvents: real_time (realtime
-    indexes that match the replay duration), unspent_rsrc,
-    rsrc_collection_rate.
+# Attributes extracted from each PlayerStatsEvent and the types used to
+# store them. The resources fit in 32 bit integers, and the supply values
+# are multiples of 1/4096, which 32 bit floats represent exactly.
+PSTATSE_COLUMNS = {
+    'second': np.int32,
+    'minerals_current': np.int32,
+    'vespene_current': np.int32,
+    'minerals_used_active_forces': np.int32,
+    'vespene_used_active_forces': np.int32,
+    'minerals_collection_rate': np.int32,
+    'vespene_collection_rate': np.int32,
+    'workers_active_count': np.int32,
+    'minerals_used_in_progress': np.int32,
+    'vespene_used_in_progress': np.int32,
+    'resources_used_in_progress': np.int32,
+    'minerals_used_current': np.int32,
+    'vespene_used_current': np.int32,
+    'resources_used_current': np.int32,
+    'minerals_lost': np.int32,
+    'vespene_lost': np.int32,
+    'resources_lost': np.int32,
+    'minerals_killed': np.int32,
+    'vespene_killed': np.int32,
+    'resources_killed': np.int32,
+    'food_used': np.float32,
+    'food_made': np.float32
+    }
+
+
+def get_pstatse_columns(rpl: sc2reader.resources.Replay,
+                        pid: int) -> dict[str, np.ndarray]:
+    """Extracts the time series of a player's PlayerStatsEvents as a set
+    of columns.
+
+    The attributes listed in `PSTATSE_COLUMNS` are read from the events in
+    a single pass into an array of records. The function then adds the
+    following columns: real_time (realtime indexes that match the replay
+    duration), unspent_rsrc, army_value, rsrc_collection_rate and
+    supply_capped. Each of these columns follows the last column it is
+    computed from.
 
     *Args*
         - rpl (sc2reader.resources.Replay)
             Working replay.
-        - df (pd.DataFrame)
-            DataFrame containing the data on the main macroeconomic
-            indicators recorded in the Replay's the PlayerStatsEvents.
+        - pid (int)
+            The player's id.
 
     *Returns*
-        - pd.DataFrame
-            Expanded DataFrame that includes all relevant data about a
-            replay's macroeconomic indicators.
-
+        - dict[str, np.ndarray]
+            The columns, in the order of the player's macroeconomic
+            DataFrame (see `get_player_macro_econ_df`).
     """
-    # Eliminate the record of the loser record if present.
-    if (df.iloc[-1] == df.iloc[-2]).all():
-        df_no_loss_record = df.drop([len(df)-1])
-    else:
-        df_no_loss_record = df.copy()
-
-    # Get the last recorded time in the dataframe
-    last_time_record = df_no_loss_record.iloc[-1].second
-
-    # Calculate the values for the real time column
-    real_time_indexes = [calc_realtime_index(rec_time_ind, rpl)
-                         for rec_time_ind in df_no_loss_record.second]
-
-    # Add the real_time indexes column to the data frame
-    df_no_loss_record.insert(0,'real_time', real_time_indexes)
-
-    # Add columns for extra features
-    df_no_loss_record.insert(4,'unspent_rsrc',
-                            (df_no_loss_record.minerals_current
-                            + df_no_loss_record.vespene_current))
-    df_no_loss_record.insert(7,'army_value',
-                            (df_no_loss_record.minerals_used_active_forces
-                            +df_no_loss_record.vespene_used_active_forces))
-    df_no_loss_record.insert(10,'rsrc_collection_rate',
-                            (df_no_loss_record.minerals_collection_rate
-                            + df_no_loss_record.vespene_collection_rate))
-
-    supply_capped_column = np.where(df_no_loss_record['food_made'] <=
-                                    df_no_loss_record['food_used'],
-                                    True, False)
+    pstatse_list = get_pstatse(rpl, pid)
+    # np.fromiter only builds arrays of records from numpy 1.23, so the
+    # records are read into a list of tuples first.
+    records = np.array(list(map(operator.attrgetter(*PSTATSE_COLUMNS),
+                                pstatse_list)),
+                       dtype=list(PSTATSE_COLUMNS.items()))
 
-    df_no_loss_record.insert(26, 'supply_capped', supply_capped_column)
-    return df_no_loss_record
+    # Eliminate the record of the loser record if present.
+    if len(records) > 1 and records[-1] == records[-2]:
+        records = records[:-1]
+
+    columns = {'real_time': (get_timeline(rpl)
+                             .to_realtime(records['second']))}
+    for name in PSTATSE_COLUMNS:
+        columns[name] = records[name]
+        if name == 'vespene_current':
+            columns['unspent_rsrc'] = (records['minerals_current']
+                                       + records['vespene_current'])
+        elif name == 'vespene_used_active_forces':
+            columns['army_value'] = (records['minerals_used_active_forces']
+                                     + records['vespene_used_active_forces'])
+        elif name == 'vespene_collection_rate':
+            columns['rsrc_collection_rate'] = (
+                records['minerals_collection_rate']
+                + records['vespene_collection_rate'])
+
+    columns['supply_capped'] = records['food_made'] <= records['food_used']
+    return columns
 
 # Internal Cell
 # Functions for specific indicators
@@ -121,45 +143,74 @@ def get_subdf_mean(subdf: pd.DataFrame) -> float:
     return subdf.mean()
 
 def get_subdf_total(subdf: pd.DataFrame) -> float:
-    """Wraper for the pd.DataFrame.mean() function.
+    """Returns the last value of a pd.Series or a numpy array.
 
     *Args*
         -subdf (pd.DataFrame)
-               This is the DatraFrame whos mean will be evaluated.
+               This is the DatraFrame whos last value will be returned.
 
     *Returns*
         - float
             Total value of a particular attribute up to a certain point of
             the game.
     """
-    return subdf.iloc[len(subdf)-1]
-
-def get_cappedTime(subdf:pd.DataFrame) -> float:
-    lapse_start = 0
-    capped_lapses = []
-
-    # Verify row by row if at the time the supply was capped.
-    # Add a time lapse to the capped_lapses list every time concludes.
-    for _, row in subdf.iterrows():
-        if row['supply_capped']:
-            if not lapse_start:
-                lapse_start = row['real_time']
-        else:
-            if lapse_start:
-                capped_lapses.append(row['real_time'] - lapse_start)
-                lapse_start = 0
+    return np.asarray(subdf)[-1]
+
+def calc_capped_lapses(real_time: np.ndarray,
+                       supply_capped: np.ndarray) -> list[float]:
+    """Lists the durations of the lapses in which a player's supply was
+    capped, in chronological order.
+
+    A lapse starts at the first capped record of a run of capped records,
+    and ends at the next record that is not capped. If the interval
+    finishes capped, its last lapse is extended by the length of its last
+    record. Records at the real time 0 do not start a lapse.
+
+    *Args*
+        - real_time (np.ndarray)
+            Real time of the records of a game interval.
+        - supply_capped (np.ndarray)
+            Boolean array that flags the records in which the supply was
+            capped.
+
+    *Returns*
+        - list[float]
+            Duration of each lapse in seconds.
+    """
+    real_time = np.asarray(real_time, dtype=float)
+    capped = np.asarray(supply_capped, dtype=bool) & (real_time != 0)
+
+    # Find the runs of capped records: each run starts where the capped
+    # flag goes up and ends at the record where it goes down again.
+    edges = np.diff(capped.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    # Runs that end before the last record last until that record.
+    closed = ends < len(real_time)
+    capped_lapses = (real_time[ends[closed]]
+                     - real_time[starts[closed]]).tolist()
 
     # Verify if the interval finished capped. If so, account
     # for the lapse.
-    if lapse_start:
+    if not closed.all():
+        last_event_length = (real_time[-1] - real_time[-2]
+                             if len(real_time) > 1 else 0.0)
+        capped_lapses.append(float(real_time[-1] - real_time[starts[-1]]
+                                   + last_event_length))
 
-        last_event_length = (subdf.iloc[-1]['real_time']
-                             - subdf.iloc[-2]['real_time'])
-        capped_lapses.append(subdf.iloc[-1]['real_time']
-                             - lapse_start + last_event_length)
+    return capped_lapses
 
+
+def get_cappedTime(capped_lapses: list[float]) -> float:
     return sum(capped_lapses)
 
+def get_capped_episodes(capped_lapses: list[float]) -> int:
+    return len(capped_lapses)
+
+def get_longest_capped_time(capped_lapses: list[float]) -> float:
+    return max(capped_lapses, default=0)
+
 
 def calculate_spending_coeficient(unspent_rsrc: float,
                                   total_rates: float) -> float:
@@ -170,6 +221,7 @@ def calculate_spending_coeficient(unspent_rsrc: float,
 
 # Internal Cell
 
+@cached_intermediate
 def get_player_macro_econ_df(rpl: sc2reader.resources.Replay,
                              pid: int) -> pd.DataFrame:
     """This function organises the records of a player's major
@@ -196,51 +248,23 @@ def get_player_macro_econ_df(rpl: sc2reader.resources.Replay,
             to an attribute, each row to a moment during the match.
     """
 
-    columns_names =[
-    'second',
-    'minerals_current',
-    'vespene_current',
-    'minerals_used_active_forces',
-    'vespene_used_active_forces',
-    'minerals_collection_rate',
-    'vespene_collection_rate',
-    'workers_active_count',
-    'minerals_used_in_progress',
-    'vespene_used_in_progress',
-    'resources_used_in_progress',
-    'minerals_used_current',
-    'vespene_used_current',
-    'resources_used_current',
-    'minerals_lost',
-    'vespene_lost',
-    'resources_lost',
-    'minerals_killed',
-    'vespene_killed',
-    'resources_killed',
-    'food_used',
-    'food_made'
-    ]
-
-    # Generate a DataFrame with the columns listed above
-    pstatse_list = get_pstatse(rpl, pid)
-    pstatse_dicts_list = [event.__dict__ for event in pstatse_list]
-    pstatse_df = pd.DataFrame(pstatse_dicts_list, columns= columns_names)
-
-    # Complete the DataFrame with the real_time, unspent_rsrc columns and
-    # army_value.
-    # Also, eliminate possible duplicate last record.
-    return complete_pstatse_df(rpl, pstatse_df)
+    # Build the DataFrame at once from the columns of the player's events,
+    # which already include the real_time, unspent_rsrc, army_value,
+    # rsrc_collection_rate and supply_capped columns.
+    # The possible duplicate last record is also eliminated.
+    return pd.DataFrame(get_pstatse_columns(rpl, pid))
 
 # Cell
 
 def gen_interval_sub_dfs(rpl_length: float,
-                        df: pd.DataFrame, column: str) -> pd.DataFrame:
+                        df: pd.DataFrame, column: str,
+                        stages: Game_stages = GAME_STAGES) -> pd.DataFrame:
     """Extract a set of DataFrames containing the records for a particular
     field of the PlayerStatsEvent.
 
     The function extracts the information of a particular column of the df
-    DataFrame. It returns a list of four DataFrames for the whole, early,
-    mid and late game intervals.
+    DataFrame. It returns a list with a DataFrame for each game stage, by
+    default the whole, early, mid and late game intervals.
 
     *Args*
         - df (pd.DataFrame)
@@ -252,30 +276,17 @@ def gen_interval_sub_dfs(rpl_length: float,
             Length of a match in seconds.
         - column (str)
             Name of the column that should be extracted in the DataFrames
+        - stages (Game_stages = GAME_STAGES)
+            Stages of the match in which the records are split.
 
     *Returns*
         - list[DataFrame]
             List of the DataFrames, containing the column information for
-            the whole, early, mid and late games in that order.
+            each stage in that order.
     """
-    process_df = df.copy()
-    early_mark = INTERVALS_BASE
-    mid_mark = early_mark * 2
-
-
-    if rpl_length > mid_mark:
-        time_intervals = [(0, rpl_length), (0, early_mark),
-                         (early_mark, mid_mark), (mid_mark, rpl_length)]
+    time_intervals = get_stage_intervals(rpl_length, stages)
 
-    elif early_mark < rpl_length <= mid_mark:
-        time_intervals = [(0, rpl_length), (0, early_mark),
-                         (early_mark, rpl_length), None]
-
-    elif 0 < rpl_length <= early_mark:
-        time_intervals = [(0, rpl_length), (0, rpl_length), None, None]
-
-
-    sub_dfs = [process_df[column].loc[process_df.real_time.between(*interval)]
+    sub_dfs = [df[column].loc[df.real_time.between(*interval)]
                if interval != None else pd.DataFrame()
                for interval in time_intervals]
 
@@ -285,7 +296,8 @@ def gen_interval_sub_dfs(rpl_length: float,
 
 def list_attr_interval_values(df: pd.DataFrame,
                             func: Callable[[pd.DataFrame], Any],
-                            df_attribute: str, rpl_length: float) -> list[Any]:
+                            df_attribute: str, rpl_length: float,
+                            stages: Game_stages = GAME_STAGES) -> list[Any]:
     """Lists the result of a function it receives applied to the values of
     various listed DataFrames.
 
@@ -305,6 +317,8 @@ def list_attr_interval_values(df: pd.DataFrame,
         - rpl_length (float)
             The duration of the Replay from which the DataFrame is
             constructed in seconds.
+        - stages (Game_stages = GAME_STAGES)
+            Game intervals in which the DataFrame is split.
 
     *Returns*
         -  List of the return values of the function func applied to the
@@ -312,12 +326,126 @@ def list_attr_interval_values(df: pd.DataFrame,
 
     """
     return [func(subdf) if not subdf.empty else None
-            for subdf in gen_interval_sub_dfs(rpl_length, df, df_attribute)]
+            for subdf in gen_interval_sub_dfs(rpl_length, df, df_attribute,
+                                              stages)]
+
+# Internal Cell
+# Helper function that lists the (start, end) real time intervals of the
+# stages of a match (by default, the whole, early, mid and late games). The
+# stages that the match does not reach are None.
+def get_stage_intervals(rpl_length: float,
+                        stages: Game_stages = GAME_STAGES) \
+                        -> list[Optional[tuple[float, float]]]:
+    return stages.intervals(rpl_length)
+
+
+# Helper function that flags the records of each stage of a match, based on
+# their real time. As with pandas.Series.between, the bounds of the
+# intervals are included. The result has a row per stage.
+def get_stage_masks(real_time: np.ndarray, rpl_length: float,
+                    stages: Game_stages = GAME_STAGES) -> np.ndarray:
+    return stages.masks(real_time, rpl_length)
+
+
+# Helper functions that compute the mean and the last value of a column in
+# every stage at once. The columns hold integers, so the sums are exact and
+# the means equal those of get_subdf_mean.
+def stage_means(values: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    counts = masks.sum(axis=1)
+    sums = masks @ values.astype(float)
+    return sums / np.maximum(counts, 1)
+
+def stage_totals(values: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    last_records = masks.shape[1] - 1 - masks[:, ::-1].argmax(axis=1)
+    return values[last_records]
+
+# Vectorised versions of the functions that aggregate_stages applies to
+# the columns.
+STAGE_REDUCERS = {get_subdf_mean: stage_means,
+                  get_subdf_total: stage_totals}
+
+
+def aggregate_stages(df: pd.DataFrame, rpl_length: float,
+                     indicators: list[tuple[str, str, Callable]],
+                     stages: Game_stages = GAME_STAGES) \
+                     -> dict[str, list[Any]]:
+    """Computes a set of indicators for each stage of a match (by default,
+    the whole, early, mid and late games).
+
+    The records of all the stages are flagged at once. The means and the
+    last values of the columns (see `get_subdf_mean` and `get_subdf_total`)
+    are then computed for all the stages in a single operation, while the
+    other functions receive the values of each stage.
+
+    *Args*
+        - df (pd.DataFrame)
+            DataFrame of a player's PlayerStatsEvents, as built by
+            `get_player_macro_econ_df`.
+        - rpl_length (float)
+            Length of the match in seconds.
+        - indicators (list[tuple[str, str, Callable]])
+            Name of each indicator, the column of df it is computed from,
+            and the function applied to the column's values in each stage.
+            The special column 'capped_lapses' passes the list of lapses
+            with the supply capped (see `calc_capped_lapses`).
+        - stages (Game_stages = GAME_STAGES)
+            Stages in which the indicators are computed.
+
+    *Returns*
+        - dict[str, list[Any]]
+            The values of each indicator for each stage. The value is None
+            if the stage has no records.
+    """
+    real_time = df['real_time'].to_numpy()
+    masks = get_stage_masks(real_time, rpl_length, stages)
+    filled = masks.any(axis=1)
+    if not filled.any():
+        return {name: [None]*len(stages) for name, _, _ in indicators}
+
+    indicator_groups = dict()
+    stage_funcs = []
+    for name, column, func in indicators:
+        if func in STAGE_REDUCERS and column != 'capped_lapses':
+            values = STAGE_REDUCERS[func](df[column].to_numpy(), masks)
+            indicator_groups[name] = [value if is_filled else None
+                                      for value, is_filled
+                                      in zip(values, filled)]
+        else:
+            indicator_groups[name] = []
+            stage_funcs.append((name, column, func))
+
+    if not stage_funcs:
+        return indicator_groups
+
+    columns = {column: df[column].to_numpy()
+               for column in {column for _, column, _ in stage_funcs}
+               if column != 'capped_lapses'}
+    if any(column == 'capped_lapses' for _, column, _ in stage_funcs):
+        columns.setdefault('real_time', real_time)
+        columns.setdefault('supply_capped', df['supply_capped'].to_numpy())
+
+    for mask, is_filled in zip(masks, filled):
+        if not is_filled:
+            for name, _, _ in stage_funcs:
+                indicator_groups[name].append(None)
+            continue
+
+        stage = {column: values[mask] for column, values in columns.items()}
+        if 'supply_capped' in stage:
+            stage['capped_lapses'] = calc_capped_lapses(
+                                        stage['real_time'],
+                                        stage['supply_capped'])
+
+        for name, column, func in stage_funcs:
+            indicator_groups[name].append(func(stage[column]))
+
+    return indicator_groups
 
 # Cell
 
 def get_player_macro_econ_stats(rpl: sc2reader.resources.Replay,
-                                pid: int)-> dict:
+                                pid: int,
+                                stages: Game_stages = GAME_STAGES)-> dict:
     """This function organises a player's major macroeconomic performance
     indicatorsinto a dictionary.
 
@@ -335,6 +463,9 @@ def get_player_macro_econ_stats(rpl: sc2reader.resources.Replay,
                 A player's id number distinguishes them from the other
                 players in a match. It can be extracted from a Participant
                 object through the pid attribute.
+        - stages (Game_stages = GAME_STAGES)
+                Game stages in which the indicators are calculated. Their
+                names are the suffixes of the indicators' keys.
 
     *Returns*
         - dict
@@ -384,16 +515,18 @@ def get_player_macro_econ_stats(rpl: sc2reader.resources.Replay,
                      get_subdf_total),
                     ('lost_vespene_totals', 'vespene_lost',
                      get_subdf_total),
-                    ('time_supply_capped', ['real_time', 'supply_capped'],
-                     get_cappedTime)
+                    ('time_supply_capped', 'capped_lapses',
+                     get_cappedTime),
+                    ('supply_capped_episodes', 'capped_lapses',
+                     get_capped_episodes),
+                    ('longest_time_supply_capped', 'capped_lapses',
+                     get_longest_capped_time)
                     ]
 
-    # Run the functions to build dict
-    indicator_groups = {k: list_attr_interval_values(pstatse_complete_df,
-                                                     func, attr,
-                                                     rpl_length)
-                        for (k, attr, func)
-                        in main_indicators_params}
+    # Run the functions to build dict, selecting the records of each
+    # game stage only once.
+    indicator_groups = aggregate_stages(pstatse_complete_df, rpl_length,
+                                        main_indicators_params, stages)
 
 
 
@@ -407,11 +540,9 @@ def get_player_macro_econ_stats(rpl: sc2reader.resources.Replay,
                            indicator_groups['resource_collection_rate_avg'])
                     ]
 
-    game_intervals = ['whole', 'early', 'mid', 'late']
-
-    attr_full_list = {f'{k}_{interval}':v[game_intervals.index(interval)]
+    attr_full_list = {f'{k}_{interval}': value
                       for k, v in indicator_groups.items()
-                      for interval in game_intervals}
+                      for interval, value in zip(stages.names, v)}
 
     replay_info.update(attr_full_list)
 
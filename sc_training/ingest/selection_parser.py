@@ -1,101 +1,262 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 06_selection_parser.ipynb (unless otherwise specified).
 
-__all__ = ['CtrlGroupTracker', 'count_max_active_groups', 'calc_ctrlg_ratio', 'calc_get_ctrl_grp_ratio',
-           'calc_select_ratio']
+__all__ = ['Ctrl_group_history', 'CtrlGroupTracker', 'set_up_plugins', 'count_max_active_groups', 'calc_ctrlg_ratio',
+           'calc_get_ctrl_grp_ratio', 'calc_select_ratio']
 
 # Internal Cell
 # Load Module's dependencies
+from array import array
+from itertools import chain
 from pathlib import Path
 from pprint import pprint
 from typing import *
 
 import json
 import pandas as pd
-import fastcore.test as ft
+import numpy as np
+
+from dataclasses import dataclass
 
 # Internal Cell
 import sc2reader
+from sc2reader.engine.plugins import SelectionTracker
 
 from .handle_tracker_event import *
 from .macro_econ_parser import *
 
 # Cell
+class Ctrl_group_history:
+    """Sizes of a player's control groups 1 to 9 throughout a match.
+
+    Rather than a copy of every group after each `ControlGroupEvent`, the
+    history only stores the changes to the size of the groups, in the
+    order they happened, as packed integer columns. The size of the
+    groups at any second of the match is rebuilt from these changes.
+
+    *Attributes*
+        - changes (list[tuple[int, int, int]])
+            The (second, group, size) of each change.
+        - sizes (list[int])
+            Current size of each group, indexed from 1 to 9.
+    """
+    def __init__(self):
+        self.sizes = [0]*10
+        self.active = 0
+        self._seconds = array('q')
+        self._groups = array('b')
+        self._sizes = array('q')
+        self._active_counts = array('b', [0])
+
+    @property
+    def changes(self) -> list[tuple[int, int, int]]:
+        return list(zip(self._seconds, self._groups, self._sizes))
+
+    def update(self, second: int, group: int, size: int) -> None:
+        """Records the size of a control group at a second of the match,
+        if the size changed."""
+        previous = self.sizes[group]
+        if size == previous:
+            return
+
+        self.sizes[group] = size
+        self.active += (size > 0) - (previous > 0)
+        self._seconds.append(second)
+        self._groups.append(group)
+        self._sizes.append(size)
+        self._active_counts.append(self.active)
+
+    def count_active_groups(self, seconds: np.ndarray) -> np.ndarray:
+        """Counts the groups that have units at each of the given seconds,
+        after all the changes registered up to that second."""
+        change_seconds = np.frombuffer(self._seconds, dtype=np.int64)
+        active_counts = np.frombuffer(self._active_counts, dtype=np.int8)
+        return active_counts[np.searchsorted(change_seconds, seconds,
+                                             side='right')].astype(np.int64)
+
+    def __getitem__(self, second: int) -> dict[int, int]:
+        """Size of each group at a second of the match, indexed from 1 to
+        9."""
+        sizes = [0]*10
+        changes = np.searchsorted(self._seconds, second, side='right')
+        for group, size in zip(self._groups[:changes],
+                               self._sizes[:changes]):
+            sizes[group] = size
+        return {group: sizes[group] for group in range(1, 10)}
+
+    def __repr__(self) -> str:
+        return f'Ctrl_group_history({len(self._seconds)} changes)'
+
 class CtrlGroupTracker(object):
     """Tracks the composition of the Replay's Players Control Groups.
 
     Using this plug-in, the Replay object will include the `ctrl_grp_trk`
-    attribute. This attribute will store a dictionary of the control group
-    compositions using the replay's human players' ids (`pid`) as keys.
-    i.e.:
-	`dict[pid (int):  control_group_compositions (dict)]`
-
-    Each of these dictionaries uses the `second` attribute of a
-    `ControlGroupEvent` as an index and organises the control group
-    composition as one more dictionary, indexed with the integers 1 to 9,
-    which stores a list of units that compose each one of the nine control
-    groups of the player. i.e.
-
-    `dict[pid(int): dict[second(int): dict[group(int): list_of_units]]]`
+    attribute. This attribute stores a `Ctrl_group_history` of the size of
+    the control groups of each of the replay's human players, using their
+    ids (`pid`) as keys. i.e.
+
+    `dict[pid(int): Ctrl_group_history]`
+
+    The sizes are checked each time the player triggers a
+    `ControlGroupEvent`, and the history only records the groups whose
+    size changed.
     """
-    from sc2reader.engine.plugins import SelectionTracker
-    sc2reader.engine.register_plugin(SelectionTracker())
     name = "CtrlGroupTracker"
 
     def handleInitGame(self, event, replay):
         replay.ctrl_grp_trk = dict()
         for human in replay.humans:
-            selection = human.selection
-            replay.ctrl_grp_trk[human.pid] = {0:{k: v for k, v
-                                                in selection.items()
-                                                if 0<k<10}}
+            replay.ctrl_grp_trk[human.pid] = Ctrl_group_history()
+            self.record(replay, human, 0)
 
-    def handleEvent(self, event, replay):
+    def handleControlGroupEvent(self, event, replay):
+        self.record(replay, event.player, event.second)
 
-        if isinstance(event, sc2reader.events.game.ControlGroupEvent):
-            selection = event.player.selection
-            replay.ctrl_grp_trk[event.player.pid][event.second] = {
-                                                        k: v for k, v
-                                                        in selection.items()
-                                                        if 0<k<10}
-
-# Internal Cell
-def count_active_groups(ctrl_grps: dict[int, list]) -> int:
-    '''Count how many of the control groups have units assign to them.
-
-    *Args*
-        - ctrl_grps (dict[int, list])
-            Control group compossitions indexed from 1 to 9
-
-    *Returns*
-        - (int)
-            Number of active control groups
-    '''
-    count = 0
-    for l in ctrl_grps.values():
-        if l:
-            count += 1
-
-    return count
+    # Helper method that records the sizes of a player's control groups.
+    def record(self, replay, player, second):
+        history = replay.ctrl_grp_trk[player.pid]
+        for group in range(1, 10):
+            history.update(second, group, len(player.selection[group]))
 
+# Cell
+def set_up_plugins() -> None:
+    """Registers the `sc2reader` plug-ins that the indicator functions
+    need: `SelectionTracker` and the `CtrlGroupTracker` that reads the
+    selections it tracks.
+
+    Only the replays loaded after this call include the `ctrl_grp_trk`
+    attribute. The plug-ins are registered only once (see
+    `register_plugin`), so the function can be called several times, e.g.
+    by every worker process of an ingest run.
+    """
+    register_plugin(SelectionTracker())
+    register_plugin(CtrlGroupTracker())
 
 # Internal Cell
-def build_ctrlg_df(events: list,
-                   rpl:sc2reader.resources.Replay) -> pd.DataFrame:
-
-    raw_df = pd.DataFrame([e.__dict__ for e in events])[['second',
-                                                         'player',
-                                                         'name',
-                                                         'control_group']]
-
-    raw_df.insert(1, 'pid', [player.pid for player in raw_df.player])
-    raw_df.insert(0, 'real_time',
-                  [calc_realtime_index(sec, rpl) for sec in raw_df.second])
-
-    return raw_df.drop(['player'], axis=1)
+@dataclass(frozen=True)
+class Selection_table:
+    """Distinct seconds of a match in which a player issued commands,
+    selected units or used their control groups.
+
+    *Attributes*
+        - second (np.ndarray)
+            Sorted seconds with at least one of the events.
+        - real_time (np.ndarray)
+            Real time of each second.
+        - command (np.ndarray)
+            Flags the seconds with a `CommandEvent`.
+        - select (np.ndarray)
+            Flags the seconds with a `SelectionEvent`.
+        - ctrlg (np.ndarray)
+            Flags the seconds with a `ControlGroupEvent`.
+        - get_ctrlg (np.ndarray)
+            Flags the seconds with a `GetControlGroupEvent`.
+    """
+    second: np.ndarray
+    real_time: np.ndarray
+    command: np.ndarray
+    select: np.ndarray
+    ctrlg: np.ndarray
+    get_ctrlg: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.second)
+
+# Event classes read by `get_selection_tables` and the flags they set.
+SELECTION_EVENTS = {sc2reader.events.game.CommandEvent: 'command',
+                    sc2reader.events.game.SelectionEvent: 'select',
+                    sc2reader.events.game.ControlGroupEvent: 'ctrlg',
+                    sc2reader.events.game.GetControlGroupEvent: 'get_ctrlg'}
+
+# Helper function that builds the Selection_tables of all the players in a
+# single pass through the replay's indexed command, selection and control
+# group events.
+@cached_intermediate
+def get_selection_tables(rpl: sc2reader.resources.Replay) \
+                         -> dict[int, Selection_table]:
+    index = index_events(rpl)
+    timeline = get_timeline(rpl)
+
+    tables = {}
+    for pid in rpl.player:
+        seconds = [{event.second for event in index.get((event_class, pid), ())}
+                   for event_class in SELECTION_EVENTS]
+        second = np.array(sorted(set().union(*seconds)), dtype=np.int64)
+
+        # A row of flags per type of event, set with a single lookup of
+        # all the seconds. The rows are the table's flag columns.
+        flags = np.zeros((len(seconds), len(second)), dtype=bool)
+        rows = np.repeat(np.arange(len(seconds)),
+                         [len(flag_seconds) for flag_seconds in seconds])
+        flags[rows, np.searchsorted(second, np.fromiter(chain(*seconds),
+                                                        dtype=np.int64))] = True
+
+        tables[pid] = Selection_table(second, timeline.to_realtime(second),
+                                      *flags)
+    return tables
+
+# Helper function that returns the Selection_table of a player.
+def get_selection_table(rpl: sc2reader.resources.Replay,
+                        pid: int) -> Selection_table:
+    return get_selection_tables(rpl)[pid]
+
+# Helper function that lists the positions of the stages that do not cover
+# the whole match. The ratios of the stages that do would repeat the ratios
+# of the whole match.
+def partial_stages(stages: Game_stages) -> list[int]:
+    return [num for num, bounds in enumerate(stages.bounds)
+            if bounds != (0, None)]
+
+# Helper function that counts the seconds flagged by each flag of a
+# player's Selection_table, and by the unions of flags that the ratios
+# compare them to, in the whole match (first count) and in each game stage
+# that does not cover the whole match. The counts are shared by the three
+# ratio functions.
+@cached_intermediate
+def count_selection_seconds(rpl: sc2reader.resources.Replay,
+                            pid: int,
+                            stages: Game_stages) -> dict[str, list[int]]:
+    table = get_selection_table(rpl, pid)
+    flags = {flag: getattr(table, flag) for flag in SELECTION_EVENTS.values()}
+    flags['all_events'] = table.command | table.select | table.ctrlg
+    flags['all_selections'] = table.select | table.get_ctrlg
+
+    # The real times of the table are sorted, so the records of each stage
+    # are a slice of the table, and the flags counted in a slice are the
+    # difference between two cumulative counts.
+    cumulative = np.zeros((len(flags), len(table) + 1), dtype=np.int64)
+    np.cumsum(list(flags.values()), axis=1, out=cumulative[:, 1:])
+
+    starts, ends = stages.limits(rpl.length.seconds)
+    ends = np.minimum(ends, rpl.length.seconds)
+    first = np.searchsorted(table.real_time, starts, side='left')
+    last = np.searchsorted(table.real_time, ends, side='right')
+    last = np.where(starts < rpl.length.seconds, np.maximum(first, last),
+                    first)
+
+    partial = partial_stages(stages)
+    counts = (cumulative[:, [len(table), *last[partial]]]
+              - cumulative[:, [0, *first[partial]]])
+    return {flag: row.tolist() for flag, row in zip(flags, counts)}
+
+# Helper function that calculates the ratio between the seconds flagged by
+# `part` and those flagged by `whole`, for the whole match and for each
+# game stage that does not cover the whole match.
+def selection_ratios(rpl: sc2reader.resources.Replay,
+                     pid: int,
+                     key: str,
+                     part: str,
+                     whole: str,
+                     stages: Game_stages) -> dict[str, float]:
+    counts = count_selection_seconds(rpl, pid, stages)
+    ratios = [count / total if total else 0
+              for count, total in zip(counts[part], counts[whole])]
+    names = [stages.names[num] for num in partial_stages(stages)]
+    return dict(zip([key] + [f'{name}_{key}' for name in names], ratios))
 
 # Cell
 def count_max_active_groups(rpl: sc2reader.resources.Replay,
-                      pid: int) -> dict[str, float]:
+                      pid: int,
+                      stages: Game_stages = GAME_STAGES) -> dict[str, float]:
     """Counts the maximum number of active control groups during the
     different stages of the game.
 
@@ -105,42 +266,37 @@ def count_max_active_groups(rpl: sc2reader.resources.Replay,
         - pid (int)
             In-game player ID of the player being considered in the
             analysis.
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the maximums are counted.
 
     *Returns*
         - dict[str, int]
             Maximum number of active control groups at each game stage
             indexed with the keys [stage]_max_act_grps
     """
-    column_names = ['whole_max_act_grps', 'early_max_act_grps',
-                    'mid_max_act_grps', 'late_max_act_grps']
-    ctrl_grp_e = [e for e in rpl.events
-                if isinstance(e, sc2reader.events.game.ControlGroupEvent)
-                and e.pid == (pid - 1)]
+    column_names = [f'{name}_max_act_grps' for name in stages.names]
+    table = get_selection_table(rpl, pid)
 
-    if not ctrl_grp_e:
+    if not table.ctrlg.any():
         return {name: 0 for name in column_names}
 
-    ctrl_grp_e_df = build_ctrlg_df(ctrl_grp_e, rpl)
-
-    grp_trk = rpl.ctrl_grp_trk
-    grp_trk_indexes = [(row[1].pid, row[1].second)
-                        for row in ctrl_grp_e_df.iterrows()]
-    ctrl_grp_e_df['active_groups'] = [count_active_groups(grp_trk[player][sec])
-                                      for player, sec in grp_trk_indexes]
+    # Count the active groups at each second with a ControlGroupEvent.
+    seconds = table.second[table.ctrlg]
+    active_groups = rpl.ctrl_grp_trk[pid].count_active_groups(seconds)
 
+    # Take the maximum of every stage at once. The stages without events
+    # count 0 active groups.
+    masks = stages.masks(table.real_time[table.ctrlg], rpl.length.seconds)
+    max_groups = np.where(masks, active_groups, 0).max(axis=1)
 
-
-    interv_dfs= gen_interval_sub_dfs(rpl.length.seconds,
-                                     ctrl_grp_e_df,
-                                     ['active_groups'])
-
-    return {name: (df.agg('max')['active_groups'] if
-                   not df.empty else 0)
-            for name, df in zip(column_names, interv_dfs)}
+    return {name: (max_grps if has_events else 0)
+            for name, max_grps, has_events
+            in zip(column_names, max_groups, masks.any(axis=1))}
 
 # Cell
 def calc_ctrlg_ratio(rpl: sc2reader.resources.Replay,
-                      pid: int) -> dict[str, float]:
+                     pid: int,
+                     stages: Game_stages = GAME_STAGES) -> dict[str, float]:
 
     """Calculates the ratio between `ControlGroupEvents` and the union of
     the `CommandEvents`, `SelectionEvents` and `ControlGroupCommand` sets
@@ -153,73 +309,41 @@ def calc_ctrlg_ratio(rpl: sc2reader.resources.Replay,
         - pid (int)
             In-game player ID of the player being considered in the
             analysis.
+        - stages (Game_stages = GAME_STAGES)
+            Game stages in which the ratios are calculated. The stages
+            that cover the whole match, like whole, have no ratio of their
+            own.
 
     *Returns*
         - (dict[str, float])
-
+            The ratio of the whole match, indexed with the key
+            ctrlg_ratio, and the ratio of each other game stage, indexed
+            with the keys [stage]_ctrlg_ratio.
     """
-
-    command_secs = {e.second for e in rpl.events
-                    if isinstance(e, sc2reader.events.game.CommandEvent)
-                    and e.pid == (pid - 1)}
-
-    select_secs = {e.second for e in rpl.events
-                    if isinstance(e, sc2reader.events.game.SelectionEvent)
-                    and e.pid == (pid - 1)}
-
-    ctrlg_secs = {e.second for e in rpl.events
-                    if isinstance(e, sc2reader.events.game.ControlGroupEvent)
-                    and e.pid == (pid - 1)}
-
-
-    total_counted_events = len(command_secs | select_secs | ctrlg_secs)
-
-    if not total_counted_events:
-        return {"ctrlg_ratio": 0}
-
-    return {"ctrlg_ratio": len(ctrlg_secs)/total_counted_events}
+    return selection_ratios(rpl, pid, 'ctrlg_ratio', 'ctrlg', 'all_events',
+                            stages)
 
 # Cell
 def calc_get_ctrl_grp_ratio(rpl: sc2reader.resources.Replay,
-                            pid: int) -> dict[str, float]:
+                            pid: int,
+                            stages: Game_stages = GAME_STAGES) \
+                            -> dict[str, float]:
     """Calculates the ratio between `GetControlGroupEvent` to the all
     section events (i.e. the union of `GetControlGroupEvent` and
-    `SelectEvent`).
+    `SelectEvent`), for the whole match (get_ctrl_grp_ratio) and for each
+    game stage ([stage]_get_ctrl_grp_ratio).
     """
-
-    select_secs = {e.second for e in rpl.events
-                   if isinstance(e, sc2reader.events.game.SelectionEvent)
-                   and e.pid == (pid - 1)}
-
-    ctrlg_secs = {e.second for e in rpl.events
-                  if isinstance(e, sc2reader.events.game.GetControlGroupEvent)
-                  and e.pid == (pid - 1)}
-
-    selection_union = len(ctrlg_secs | select_secs)
-
-    if not selection_union:
-        return {"get_ctrl_grp_ratio": 0}
-
-    return {'get_ctrl_grp_ratio':len(ctrlg_secs)/selection_union}
+    return selection_ratios(rpl, pid, 'get_ctrl_grp_ratio', 'get_ctrlg',
+                            'all_selections', stages)
 
 # Cell
 def calc_select_ratio(rpl: sc2reader.resources.Replay,
-                            pid: int) -> dict[str, float]:
+                      pid: int,
+                      stages: Game_stages = GAME_STAGES) -> dict[str, float]:
     """Calculates the ratio between `SelectEvent` to the all
     section events (i.e. the union of `GetControlGroupEvent` and
-    `SelectEvent`).
+    `SelectEvent`), for the whole match (select_ratio) and for each game
+    stage ([stage]_select_ratio).
     """
-    select_secs = {e.second for e in rpl.events
-                   if isinstance(e, sc2reader.events.game.SelectionEvent)
-                   and e.pid == (pid - 1)}
-
-    ctrlg_secs = {e.second for e in rpl.events
-                  if isinstance(e, sc2reader.events.game.GetControlGroupEvent)
-                  and e.pid == (pid - 1)}
-
-    selection_union = len(ctrlg_secs | select_secs)
-
-    if not selection_union:
-        return {"get_ctrl_grp_ratio": 0}
-
-    return {'select_ratio':len(select_secs)/selection_union}
\ No newline at end of file
+    return selection_ratios(rpl, pid, 'select_ratio', 'select',
+                            'all_selections', stages)
\ No newline at end of file
@@ -1,6 +1,6 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: 01_summarise_rpl.ipynb (unless otherwise specified).
 
-__all__ = ['Player_data', 'Replay_data', 'get_replay_info']
+__all__ = ['Player_data', 'is_eligible_name', 'INELIGIBLE_NAME_PATTERNS', 'Replay_data', 'get_replay_info']
 
 # Internal Cell
 
@@ -12,6 +12,7 @@ from dataclasses import dataclass, astuple, field
 from datetime import datetime
 from typing import *
 
+import re
 import sc2reader
 
 # Cell
@@ -34,19 +35,51 @@ class Player_data:
         - result (str):
             Variable descriving whether the player was the matches winner
             ('Win') or loser ('Loss').
+        - is_eligible_name (bool):
+            True if the username can be used to build a player profile (see
+            `is_eligible_name`). It is computed from the username.
 
     """
     player_number: int
     username: str
     race: str
     result: str
+    is_eligible_name: bool = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'is_eligible_name',
+                           is_eligible_name(self.username))
 
     def __str__(self):
-        headers = ('Player Number:', 'User Name:', 'Race:', 'Result:')
+        headers = ('Player Number:', 'User Name:', 'Race:', 'Result:',
+                   'Eligible name:')
         print_lines = (f'{h:<15}{att:>10}\n' for h, att
                         in zip(headers, astuple(self)))
         return ''.join(print_lines)
 
+# Cell
+# Patterns of the usernames that cannot be used to build a player profile:
+# the A.I. opponents, the default 'Player 2' name and the barcode names.
+INELIGIBLE_NAME_PATTERNS = (re.compile(r'^A\.I\. [\d] [(][\w\s]*[)]$'),
+                            re.compile(r'^Player 2$'),
+                            re.compile(r'^l+$'))
+
+def is_eligible_name(username: str) -> bool:
+    """Checks if a username can be used to build a player profile, i.e. if
+    it does not match any of the `INELIGIBLE_NAME_PATTERNS`.
+
+    *Args:*
+        - username (str):
+            The player's user name.
+
+    *Returns:*
+        - bool:
+            False if the username belongs to an A.I. opponent or is a
+            default or barcode name.
+    """
+    return not any(pattern.search(username)
+                   for pattern in INELIGIBLE_NAME_PATTERNS)
+
 # Cell
 
 @dataclass(frozen=True)
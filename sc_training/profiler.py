@@ -15,8 +15,6 @@ from typing import *
 
 from .ingest import *
 
-sc2reader.engine.register_plugin(CtrlGroupTracker())
-
 # Internal Cell
 def get_top_of_category(column: pd.Series) -> str:
 
@@ -25,26 +23,44 @@ def get_top_of_category(column: pd.Series) -> str:
 
 # Internal Cell
 
-def get_user_name_list(active_db: pymongo.database.Database) -> list:
-    # Define username patters to ignore
-    ai_pat = re.compile(r'^A\.I\. [\d] [(][\w\s]*[)]$')
-    barcode_pat = re.compile(r'^l+$')
-
-    # Iterate through the records in the `replays` collection to get all valid
-    # user names.
-    players_match_count = dict()
-    for rec in active_db['replays'].find():
-        for player in rec['players']:
-            if not (ai_pat.findall(player['username'])
-                    or barcode_pat.findall(player['username'])
-                    or player['username'] == 'Player 2'):
-                players_match_count.setdefault(player['username'], 0)
-                players_match_count[player['username']] += 1
-
-    return [name
-            for name , count
-            in players_match_count.items()
-            if count >= 5]
+def get_user_name_list(active_db: pymongo.database.Database,
+                       min_matches: int = 5) -> dict[str, dict[str, int]]:
+    """Lists the usernames with enough matches in the `replays` collection
+    to build their profiles, counting the matches on the database server.
+
+    *Args*
+        - active_db (pymongo.database.Database)
+            Database that stores the replays.
+        - min_matches (int = 5)
+            Minimum number of matches of the listed usernames.
+
+    *Returns*
+        - dict[str, dict[str, int]]
+            Number of matches of each username with each race, for the
+            usernames that are eligible (see `is_eligible_name`) and have
+            at least `min_matches` matches with any race.
+    """
+    pipeline = [
+        {'$unwind': '$players'},
+        {'$match': {'$or': [
+            {'players.is_eligible_name': True},
+            # Replays ingested before the players' usernames were flagged.
+            {'players.is_eligible_name': {'$exists': False},
+             'players.username': {'$nin': list(INELIGIBLE_NAME_PATTERNS)}}]}},
+        {'$group': {'_id': {'username': '$players.username',
+                            'race': '$players.race'},
+                    'matches': {'$sum': 1}}},
+        {'$group': {'_id': '$_id.username',
+                    'matches': {'$sum': '$matches'},
+                    'races': {'$push': {'race': '$_id.race',
+                                        'matches': '$matches'}}}},
+        {'$match': {'matches': {'$gte': min_matches}}},
+        {'$sort': {'_id': 1}}]
+
+    return {user['_id']: {race['race']: race['matches']
+                          for race in user['races']}
+            for user in active_db['replays'].aggregate(pipeline,
+                                                       allowDiskUse=True)}
 
 # Internal Cell
 def get_player_replays(active_db: Any, username: str, race: str) -> list:
@@ -109,14 +125,23 @@ def build_profile(replays_df: pd.DataFrame,
 
 # Cell
 
-def build_player_race_profiles() -> None:
+def build_player_race_profiles(
+        active_db: Optional[pymongo.database.Database] = None) -> None:
     """Converts all replays in the project's database, defined in the
     project's config.json file, into a set of player profiles stored in
     that same database in the 'Protoss_Profiles', 'Terran_Profiles',
     and 'Zerg_Profiles' collections.
+
+    *Args*
+        - active_db (pymongo.database.Database, optional)
+            Database that stores the replays and where the profiles are
+            stored. Defaults to the project's database.
     """
     races = ['Protoss', 'Terran', 'Zerg']
-    active_db = set_up_db()
+    if active_db is None:
+        active_db = set_up_db()
+    else:
+        ensure_indexes(active_db)
     print(f'Accessing: {active_db.name}')
 
     for race in races:
@@ -128,8 +153,10 @@ def build_player_race_profiles() -> None:
 
     print('Generating Player Profiles')
     counts = {'Protoss':0, 'Zerg': 0, 'Terran':0}
-    for user_name in user_name_list:
+    for user_name, race_matches in user_name_list.items():
         for race in races:
+            if race not in race_matches:
+                continue
             replays = get_player_replays(active_db, user_name, race)
 
             if replays: